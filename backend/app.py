@@ -1,8 +1,24 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request, stream_with_context
+from concurrent.futures.process import BrokenProcessPool
+import json
+import os
+import queue
 import sys 
+import tempfile
+import threading
 sys.path.insert(0, './algorithm/bimaru.py')
-from bimaru import get_steps
-from bimaru import get_limits
+from bimaru import DeltaTrace
+from bimaru import make_problem
+from bimaru import read_instance
+from bimaru import solve
+from bimaru import solve_batch
+from bimaru import solve_instance
+from bimaru import TRACE_MODES
+from bimaru import TRANSPOSITIONS
+from cache import SolutionCache, instance_key
+from pool import SolverPool
+from search import SearchBudget
+import jobs
 from flask_cors import CORS
 
 app = Flask(__name__)
@@ -10,16 +26,337 @@ app = Flask(__name__)
 
 CORS(app, resources={r'/*': {'origins': '*'}})
 
+# Soluções já calculadas, por instância; BIMARU_CACHE_DIR guarda-as também em disco
+cache = SolutionCache(
+    max_bytes=int(os.environ.get("BIMARU_CACHE_BYTES", 64 << 20)),
+    directory=os.environ.get("BIMARU_CACHE_DIR"),
+    max_disk_bytes=int(os.environ.get("BIMARU_CACHE_DISK_BYTES", 1 << 30)))
+
+def steps_response(instance, mode):
+    """Corpo da resposta de GET /: os limites e os passos da procura."""
+    limits, info, _ = solve_instance(instance, mode)
+    return json.dumps([limits, info], separators=(",", ":")).encode()
+
+def solve_response(instance, mode):
+    """Corpo da resposta de POST /solve: os limites, a solução e os passos."""
+    limits, info, goal_node = solve_instance(instance, mode)
+    solution = str(goal_node.state.board).split("\n") if goal_node else None
+    return json.dumps({"limits": limits, "solution": solution,
+                       "steps": info}, separators=(",", ":")).encode()
+
+# Processos que resolvem as instâncias (BIMARU_WORKERS, por omissão um por
+# CPU; com 0 resolvem-se no processo do servidor) e número máximo de pedidos
+# à espera deles (BIMARU_QUEUE, por omissão dois por processo)
+WORKERS = int(os.environ.get("BIMARU_WORKERS", os.cpu_count()))
+QUEUE = int(os.environ.get("BIMARU_QUEUE", 0)) or None
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool():
+    """O SolverPool do servidor, criado no primeiro pedido."""
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = SolverPool(WORKERS, QUEUE)
+    return pool
+
+def run(function, *args):
+    if WORKERS == 0:
+        return function(*args)
+    return get_pool().run(function, *args)
+
+@app.errorhandler(BrokenProcessPool)
+def solver_died(error):
+    """Um processo do SolverPool morreu (por exemplo, sem memória) a meio do
+    pedido; o pool é recriado no pedido seguinte."""
+    return jsonify(error="A solver process died, try again"), 503
+
+def cached(kind, instance, mode, function):
+    """Resposta 'kind' para a instância e o modo dos passos, calculada uma
+    só vez por function(instance, mode)."""
+    key = "-".join([kind, mode, instance_key(*instance)])
+    body = cache.get_or_compute(key, lambda: run(function, instance, mode))
+    return Response(body, mimetype="application/json")
+
+def request_trace():
+    """O modo dos passos pedido no parâmetro 'trace' (ver TRACE_MODES)."""
+    mode = request.args.get("trace", "full")
+    if mode not in TRACE_MODES:
+        raise ValueError("Unknown trace mode: {}".format(mode))
+    return mode
+
 @app.route("/", methods=["GET"])
 def hello_world():
-    info = []
-    steps = get_steps()
-    limits = get_limits()
-    for step in steps:
-        step_list = []
-        for i in range(10):
-            for j in range(10):
-                step_list.append(step[i][j])
-        info.append(step_list)
-    return jsonify(limits, info)
+    try:
+        mode = request_trace()
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    with open('input.txt', 'r') as f:
+        instance = read_instance(f)
+    return cached("steps", instance, mode, steps_response)
+
+def request_instance():
+    """A instância do corpo do pedido: o texto com as linhas ROW, COLUMN,
+    HINT (e FLEET), ou JSON com "rows", "columns", "hints" (e "fleet") ou
+    com o texto em "instance"."""
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and isinstance(data.get("instance"), str):
+            data = data["instance"]
+        elif not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+        return read_instance(data)
+    return read_instance(request.get_data(as_text=True))
+
+@app.route("/solve", methods=["POST"])
+def solve_request():
+    """Resolve a instância do corpo do pedido (ver request_instance)."""
+    try:
+        mode = request_trace()
+        instance = request_instance()
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    return cached("solve", instance, mode, solve_response)
+
+@app.route("/solve/batch", methods=["POST"])
+def solve_batch_request():
+    """Resolve várias instâncias, dadas em JSON como uma lista ou como um
+    objeto {nome: instância} (cada instância como em /solve), e devolve um
+    resultado JSON por linha à medida que cada uma é resolvida."""
+    data = request.get_json(silent=True)
+    if isinstance(data, list):
+        instances = list(enumerate(data))
+    elif isinstance(data, dict):
+        instances = list(data.items())
+    else:
+        return jsonify(error="Expected a JSON list or object of instances"), 400
+
+    def results():
+        solved = get_pool().solve_batch(instances) if WORKERS else solve_batch(instances)
+        for result in solved:
+            yield json.dumps(result) + "\n"
+    return Response(stream_with_context(results()),
+                    mimetype="application/x-ndjson")
+
+class StreamClosed(Exception):
+    """O cliente deixou de ler os passos."""
+
+class StepStream(DeltaTrace):
+    """Registo dos passos que, em vez de os guardar, converte cada um numa
+    linha JSON [pai, {valor: [índices]}] (ver DeltaTrace) e a põe numa
+    fila limitada, de onde a resposta a envia. Quando a fila está cheia a
+    procura espera pelo cliente, pelo que a memória usada não cresce com o
+    número de passos."""
+
+    def __init__(self, board, maxsize=64):
+        super().__init__(board)
+        self.lines = queue.Queue(maxsize)
+        self.closed = False
+        # o token de cancelamento do orçamento da procura
+        self.cancel = threading.Event()
+        self.count = 0
+
+    def store(self, parent, changes):
+        self.put(json.dumps([parent, self.group(changes)], separators=(",", ":")))
+        self.count += 1
+        return self.count - 1
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """O cliente deixou de ler: a procura é cancelada."""
+        self.closed = True
+        self.cancel.set()
+
+    def put(self, line):
+        while True:
+            if self.closed:
+                raise StreamClosed()
+            try:
+                self.lines.put(line, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+# Procuras com os passos em streaming que podem correr ao mesmo tempo, cada
+# uma na sua thread (BIMARU_STREAMS, por omissão uma por CPU); os pedidos a
+# mais recebem 503
+STREAMS = int(os.environ.get("BIMARU_STREAMS", os.cpu_count()))
+stream_slots = threading.BoundedSemaphore(STREAMS)
+
+def stream_steps(instance, mode="full"):
+    """Resolve a instância numa thread e devolve a resposta que envia, em
+    JSON Lines, os limites e as casas do tabuleiro inicial, os passos
+    escolhidos por 'mode' e, por fim, a solução. Com "full", cada passo é
+    enviado assim que é gerado; com "path", os passos do caminho são
+    enviados no fim da procura. A procura é cancelada (pelo seu orçamento)
+    quando o cliente deixa de ler; com STREAMS procuras a correr, a
+    resposta é 503."""
+    if not stream_slots.acquire(blocking=False):
+        return jsonify(error="Too many streaming solves, try again later"), 503
+    try:
+        if mode == "full":
+            problem = make_problem(instance=instance, transpositions=TRANSPOSITIONS,
+                                   trace=StepStream)
+            stream = problem.steps
+        else:
+            problem = make_problem(instance=instance, transpositions=TRANSPOSITIONS,
+                                   trace="none")
+            stream = StepStream(problem.initial.board)
+    except BaseException:
+        stream_slots.release()
+        raise
+    budget = SearchBudget(cancel=stream.cancel)
+
+    def result():
+        try:
+            goal_node = solve(problem, budget=budget)
+            if mode == "path" and goal_node:
+                path = DeltaTrace.from_path(goal_node.path())
+                for parent, changes in zip(path.parents, path.changes):
+                    stream.store(parent, changes)
+            solution = str(goal_node.state.board).split("\n") if goal_node else None
+            return json.dumps({"solution": solution})
+        except StreamClosed:
+            raise
+        except Exception as error:
+            return json.dumps({"error": str(error)})
+
+    def search():
+        try:
+            stream.put(result())
+            stream.put(None)
+        except StreamClosed:
+            pass
+        finally:
+            stream_slots.release()
+
+    def lines():
+        try:
+            yield json.dumps({"limits": [instance[0], instance[1]],
+                              "initial": stream.initial}) + "\n"
+            while True:
+                line = stream.lines.get()
+                if line is None:
+                    return
+                yield line + "\n"
+        finally:
+            stream.close()
+
+    threading.Thread(target=search, daemon=True).start()
+    response = Response(lines(), mimetype="application/x-ndjson")
+    # se a resposta for fechada antes de começar a ser enviada
+    response.call_on_close(stream.close)
+    return response
+
+@app.route("/stream", methods=["GET"])
+def stream_request():
+    """Como GET /, mas os passos são enviados à medida que a procura os
+    gera, um por linha (ver stream_steps)."""
+    try:
+        mode = request_trace()
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    with open('input.txt', 'r') as f:
+        instance = read_instance(f)
+    return stream_steps(instance, mode)
+
+@app.route("/solve/stream", methods=["POST"])
+def solve_stream_request():
+    """Como POST /solve, mas com os passos enviados à medida que a procura
+    os gera (ver stream_steps)."""
+    try:
+        mode = request_trace()
+        instance = request_instance()
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    return stream_steps(instance, mode)
+
+# Trabalhos: resoluções longas corridas fora do pedido (ver jobs.py), guardadas
+# na base de dados SQLite BIMARU_JOBS_DB
+JOBS_DB = os.environ.get("BIMARU_JOBS_DB",
+                         os.path.join(tempfile.gettempdir(), "bimaru-jobs.sqlite3"))
+# Os trabalhos têm os seus próprios processos (BIMARU_JOB_WORKERS, por omissão
+# um; com 0 corre-os o Dispatcher), para não ocuparem os que respondem aos
+# pedidos
+JOB_WORKERS = int(os.environ.get("BIMARU_JOB_WORKERS", 1))
+job_store = None
+job_pool = None
+dispatcher = None
+jobs_lock = threading.Lock()
+
+def get_jobs():
+    """O JobStore do servidor e o Dispatcher que passa os seus trabalhos aos
+    processos do SolverPool dos trabalhos, criados no primeiro pedido."""
+    global job_store, job_pool, dispatcher
+    with jobs_lock:
+        if job_store is None:
+            job_store = jobs.JobStore(JOBS_DB)
+            if JOB_WORKERS:
+                # um trabalho por processo: os outros esperam na base de dados
+                job_pool = SolverPool(JOB_WORKERS, JOB_WORKERS)
+                submit = job_pool.submit
+            else:
+                submit = lambda function, *args: function(*args)
+            dispatcher = jobs.Dispatcher(job_store, submit)
+    return job_store
+
+def request_budget(name, kind):
+    """O limite 'name' (número de nós ou segundos) pedido, ou None."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        value = kind(value)
+    except ValueError:
+        raise ValueError("Invalid {}: {}".format(name, value))
+    if value <= 0:
+        raise ValueError("Invalid {}: {}".format(name, value))
+    return value
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """Põe a instância do corpo do pedido (como em /solve) na fila e devolve
+    o identificador do trabalho. Os parâmetros max_nodes e max_seconds
+    limitam a procura."""
+    try:
+        mode = request_trace()
+        max_nodes = request_budget("max_nodes", int)
+        max_seconds = request_budget("max_seconds", float)
+        instance = request_instance()
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    store = get_jobs()
+    job_id = store.create(instance, mode, max_nodes, max_seconds)
+    dispatcher.notify()
+    return jsonify(id=job_id, status="queued"), 202, {"Location": "/jobs/" + job_id}
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """O estado do trabalho: status, nós expandidos até agora, segundos e erro."""
+    job = get_jobs().get(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    return jsonify({key: job[key] for key in
+                    ("id", "status", "trace", "max_nodes", "max_seconds",
+                     "nodes", "seconds", "error")})
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    """O resultado de um trabalho terminado, como o de POST /solve."""
+    store = get_jobs()
+    job = store.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    if job["status"] != "done":
+        return jsonify(status=job["status"], error=job["error"]), 409
+    return Response(store.result(job_id), mimetype="application/json")
 
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancela o trabalho (se ainda não terminou)."""
+    store = get_jobs()
+    if not store.cancel(job_id):
+        return jsonify(error="Unknown job"), 404
+    return jsonify(id=job_id, status=store.get(job_id)["status"]), 202
@@ -6,39 +6,181 @@
 # 102082 Simão Sanguinho
 # 103252 José Pereira
 
+import argparse
+import functools
+import io
+import json
+import os
+import random
+from array import array
+from collections import Counter, namedtuple
 import numpy as np
 import sys
+import time
 from search import (
     Problem,
     Node,
+    SearchBudget,
     astar_search,
     breadth_first_tree_search,
     depth_first_tree_search,
+    exact_cover_search,
     greedy_search,
+    ida_star_search,
+    parallel_depth_first_search,
     recursive_best_first_search,
+    sat_search,
 )
+from sat import CNF
+from utils import TranspositionTable
+
+
+# Chaves de Zobrist: um inteiro aleatório de 64 bits por casa e valor. O
+# hash de um tabuleiro é o XOR das chaves das casas preenchidas.
+_zobrist_random = random.Random(23)
+ZOBRIST_KEYS = {}
+
+
+def zobrist_key(row: int, col: int, value: str) -> int:
+    """Devolve a chave de Zobrist do valor 'value' na casa (row, col)."""
+    key = ZOBRIST_KEYS.get((row, col, value))
+    if key is None:
+        key = ZOBRIST_KEYS[(row, col, value)] = _zobrist_random.getrandbits(64)
+    return key
+
+
+# Frota usada quando a instância não indica a sua numa linha FLEET
+FLEET = [4, 3, 3, 2, 2, 2, 1, 1, 1, 1]
+
+
+def read_instance(source) -> tuple:
+    """Lê uma instância e devolve (rows, columns, hints, fleet). 'source' é
+    o texto da instância (linhas ROW, COLUMN, HINT e FLEET), um stream com
+    essas linhas, ou um dicionário com as chaves "rows", "columns", "hints"
+    e, opcionalmente, "fleet" (a instância em JSON)."""
+    if isinstance(source, dict):
+        rows = source.get("rows", [])
+        columns = source.get("columns", [])
+        hints = source.get("hints", [])
+        fleet = source.get("fleet", FLEET)
+        return check_instance(rows, columns, hints, fleet)
+
+    rows = []
+    columns = []
+    hints = []
+    fleet = FLEET
+
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    for line in source:
+        instance = line.split()
+        line = [int(x) if x.isdigit() else x for x in instance]
+        if not line:
+            break
+        entry = line[0]
+        if entry == "ROW":
+            rows = line[1:]
+        elif entry == "COLUMN":
+            columns = line[1:]
+        elif entry == "HINT":
+            hints.append(line[1:])
+        elif entry == "FLEET":
+            fleet = line[1:]
+    return check_instance(rows, columns, hints, fleet)
+
+
+def check_instance(rows: list, columns: list, hints: list, fleet: list) -> tuple:
+    """Verifica que a instância está bem formada, já que pode vir de um
+    pedido HTTP, e devolve-a como (rows, columns, hints, fleet)."""
+    for name, value in (("rows", rows), ("columns", columns),
+                        ("hints", hints), ("fleet", fleet)):
+        if not isinstance(value, (list, tuple)):
+            raise ValueError("Invalid {}: expected a list, got {!r}"
+                             .format(name, value))
+    size = len(rows)
+    if size == 0:
+        raise ValueError("The instance has no ROW line")
+    if len(columns) != size:
+        raise ValueError("The board must be square")
+    for limit in list(rows) + list(columns):
+        if type(limit) is not int or not 0 <= limit <= size:
+            raise ValueError("Invalid row or column limit: {!r}".format(limit))
+    for length in fleet:
+        if type(length) is not int or not 1 <= length <= size:
+            raise ValueError("Invalid boat length: {!r}".format(length))
+    checked = []
+    for hint in hints:
+        if (not isinstance(hint, (list, tuple)) or len(hint) != 3
+                or type(hint[0]) is not int or type(hint[1]) is not int
+                or not 0 <= hint[0] < size or not 0 <= hint[1] < size
+                or hint[2] not in ('T', 'B', 'L', 'R', 'M', 'C', 'W')):
+            raise ValueError("Invalid hint: {!r}".format(hint))
+        checked.append(list(hint))
+    # os barcos que as hints dão inteiros são retirados da frota
+    boats = Counter(fleet)
+    for boat in hinted_boats({(row, col): value for row, col, value in checked}):
+        if boats[len(boat)] == 0:
+            raise ValueError("The hints give a boat of length {} that is not "
+                             "in the fleet".format(len(boat)))
+        boats[len(boat)] -= 1
+    return list(rows), list(columns), checked, list(fleet)
+
+
+def hinted_boats(hints: dict) -> list:
+    """Devolve as posições de cada barco que as hints {(row, col): valor}
+    dão inteiro (um círculo, ou um topo/esquerda seguido de meios e de um
+    fundo/direita)."""
+    boats = []
+    for (row, col), value in hints.items():
+        if value == 'C':
+            boats.append([(row, col)])
+        elif value in ['T', 'L']:
+            di, dj, end = (1, 0, 'B') if value == 'T' else (0, 1, 'R')
+            boat = [(row, col)]
+            i, j = row + di, col + dj
+            while hints.get((i, j)) == 'M':
+                boat.append((i, j))
+                i, j = i + di, j + dj
+            if hints.get((i, j)) == end:
+                boats.append(boat + [(i, j)])
+    return boats
 
 
 class BimaruState:
     """ Representação interna de um estado do jogo Bimaru."""
     state_id = 0
 
-    def __init__(self, board):
+    def __init__(self, board, last_boats: dict = None, step: int = -1):
         self.board = board
+        # posição (row, col, orientation) do último barco colocado de cada
+        # tamanho, usada para quebrar simetrias entre barcos iguais
+        self.last_boats = last_boats if last_boats is not None else {}
+        # número do passo em que o tabuleiro foi gerado (-1 para o inicial)
+        self.step = step
         self.id = BimaruState.state_id
         BimaruState.state_id += 1
 
     def __lt__(self, other):
         return self.id < other.id
 
+    def __eq__(self, other):
+        return isinstance(other, BimaruState) and self.board == other.board
+
+    def __hash__(self):
+        return hash(self.board)
+
 
 class Board:
     """Representação interna de um tabuleiro de Bimaru."""
+    # casas que se sabe terem barco mas que ainda não pertencem a nenhum
+    # barco colocado; só o BitBoard faz propagação de restrições
+    forced_mask = 0
 
     def __init__(self, cells, rows: list, columns: list,
                  current_boat_rows: list, current_boat_columns: list,
                  available_boats: list, available_rows: list,
-                 available_cols: list, is_valid: bool, waters: int):
+                 available_cols: list, is_valid: bool, waters: int,
+                 touched_cells: set, zobrist: int):
         """ Inicializa o tabuleiro com as dimensões dadas."""
         self.cells = cells
         self.limit_rows = rows
@@ -50,6 +192,9 @@ class Board:
         self.available_cols = available_cols
         self.is_valid = is_valid
         self.waters = waters
+        # casas alteradas desde a última chamada a check_valid
+        self.touched_cells = touched_cells
+        self.zobrist = zobrist
 
     def deepcopy(self, board):
         """ Retorna uma cópia do tabuleiro."""
@@ -62,9 +207,29 @@ class Board:
         available_cols = board.available_cols.copy()
         is_valid = board.is_valid
         waters = board.waters
+        touched_cells = board.touched_cells.copy()
         return Board(new_cells, board.limit_rows, board.limit_columns,
                      current_boat_rows, current_boat_columns, available_boats,
-                     available_rows, available_cols, is_valid, waters)
+                     available_rows, available_cols, is_valid, waters,
+                     touched_cells, board.zobrist)
+
+    def key(self) -> tuple:
+        """Chave de transposição do tabuleiro (hash de Zobrist das casas e
+        barcos por colocar)."""
+        return (self.zobrist, tuple(self.available_boats))
+
+    def __eq__(self, other):
+        return isinstance(other, Board) and \
+            self.available_boats == other.available_boats and \
+            np.array_equal(self.cells, other.cells)
+
+    def __hash__(self):
+        return self.zobrist
+
+    @property
+    def size(self) -> int:
+        """Número de linhas (e de colunas) do tabuleiro."""
+        return len(self.limit_rows)
 
     def get_value(self, row: int, col: int) -> str:
         """Devolve o valor na respetiva posição do tabuleiro."""
@@ -73,7 +238,7 @@ class Board:
 
     def valid_cell(self, row: int, col: int) -> bool:
         """Verifica se a célula é válida."""
-        return not (row < 0 or row > 9 or col < 0 or col > 9)
+        return 0 <= row < self.size and 0 <= col < self.size
 
     def temp_set_value(self, row: int, col: int, value: str) -> None:
         """ Atribui temporariamente o valor na posição do tabuleiro."""
@@ -93,6 +258,8 @@ class Board:
         """Atribui o valor na respetiva posição do tabuleiro."""
         if (self.valid_cell(row, col) and self.cells[row, col] == " "):
             self.cells[row, col] = value
+            self.touched_cells.add((row, col))
+            self.zobrist ^= zobrist_key(row, col, value)
             self.available_rows[row] -= 1
             self.available_cols[col] -= 1
             if (value == '.'):
@@ -134,12 +301,12 @@ class Board:
 
     def fill_row_with_water(self, row: int) -> None:
         """Preenche a linha 'row' com água."""
-        for col in range(10):
+        for col in range(self.size):
             self.set_value(row, col, '.')
 
     def fill_column_with_water(self, col: int) -> None:
         """Preenche a coluna 'col' com água."""
-        for row in range(10):
+        for row in range(self.size):
             self.set_value(row, col, '.')
 
     def fill_segments_with_water(self, row: int, col: int,
@@ -154,7 +321,7 @@ class Board:
 
     def fill_exausted_rows_cols(self) -> None:
         """Preenche as linhas e colunas que já estão completas."""
-        for i in range(10):
+        for i in range(self.size):
             if (self.current_boat_rows[i] == self.limit_rows[i]):
                 self.fill_row_with_water(i)
             if (self.current_boat_columns[i] == self.limit_columns[i]):
@@ -241,7 +408,7 @@ class Board:
 
         if (orientation == "H"):
             # se o barco não cabe no tabuleiro
-            if (col + length > 10):
+            if (col + length > self.size):
                 return False
             # se o barco exceede o limite de barcos na linha
             if (self.limit_rows[row] < self.current_boat_rows[row] + length):
@@ -267,7 +434,7 @@ class Board:
                     return False
 
         elif (orientation == "V"):
-            if (row + length > 10):  # se o barco não cabe no tabuleiro
+            if (row + length > self.size):  # se o barco não cabe no tabuleiro
                 return False
             # se o barco exceede o limite de barcos na coluna
             if (self.limit_columns[col] < self.current_boat_columns[col] + length):
@@ -293,319 +460,119 @@ class Board:
         return True
 
     def get_possible_actions(self) -> list:
-        """ Retorna uma lista de ações possíveis."""
+        """ Retorna uma lista de ações possíveis: as posições do maior barco
+        que falta colocar, incluindo as que completam uma hint."""
         actions = []
-        if self.is_valid == False:
-            return actions
-
-        # se é possível adicionar um barco de tamanho 4
-        if (4 in self.available_boats):
-            for i in range(10):
-                for j in range(10):
-                    value = self.get_value(i, j)
-                    if value in ['.', 'W']:
-                        continue
-                    if (self.is_possible_to_add_boat(i, j, 4, "H")):
-                        actions.append((i, j, 4, "H"))
-
-                    if (self.is_possible_to_add_boat(i, j, 4, "V")):
-                        actions.append((i, j, 4, "V"))
-
-                    if (value == "T"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i+1, j, 3, "V")):
-                            actions.append((i, j, 4, "V"))
-                        self.temp_set_value(i, j, value)
-
-                    if (value == "B"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i - 3, j, 3, "V")):
-                            actions.append((i - 3, j, 4, "V"))
-                        self.temp_set_value(i, j, value)
-
-                    if (value == "R"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i, j - 3, 3, "H")):
-                            actions.append((i, j - 3, 4, "H"))
-                        self.temp_set_value(i, j, value)
-
-                    if (value == "L"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i, j + 1, 3, "H")):
-                            actions.append((i, j, 4, "H"))
-                        self.temp_set_value(i, j, value)
-                    if (value == "M"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i, j - 1, 4, "H")):
-                            actions.append((i, j-1, 4, "H"))
-                        if (self.is_possible_to_add_boat(i, j - 2, 4, "H")):
-                            actions.append((i, j-2, 4, "H"))
-                        if (self.is_possible_to_add_boat(i-1, j, 4, "V")):
-                            actions.append((i-1, j, 4, "V"))
-                        if (self.is_possible_to_add_boat(i-2, j, 4, "V")):
-                            actions.append((i-2, j, 4, "V"))
-                        self.temp_set_value(i, j, value)
-
-            return actions
-
-        # se é possível adicionar um barco de tamanho 3
-        if (3 in self.available_boats):
-            for i in range(10):
-                for j in range(10):
-                    value = self.get_value(i, j)
-                    if value in ['.', 'W']:
-                        continue
-                    if (self.is_possible_to_add_boat(i, j, 3, "H")):
-                        actions.append((i, j, 3, "H"))
-
-                    if (self.is_possible_to_add_boat(i, j, 3, "V")):
-                        actions.append((i, j, 3, "V"))
-
-                    if (value == "T"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i+1, j, 2, "V")):
-                            actions.append((i, j, 3, "V"))
-                        self.temp_set_value(i, j, value)
-
-                    if (value == "B"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i - 2, j, 2, "V")):
-                            actions.append((i - 2, j, 3, "V"))
-                        self.temp_set_value(i, j, value)
-
-                    if (value == "R"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i, j - 2, 2, "H")):
-                            actions.append((i, j - 2, 3, "H"))
-                        self.temp_set_value(i, j, value)
-
-                    if (value == "L"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i, j + 1, 2, "H")):
-                            actions.append((i, j, 3, "H"))
-                        self.temp_set_value(i, j, value)
-
-                    if (value == "M"):
-                        value = self.get_value(i, j)
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i, j - 1, 3, "H")):
-                            actions.append((i, j-1, 3, "H"))
-                        if (self.is_possible_to_add_boat(i-1, j, 3, "V")):
-                            actions.append((i-1, j, 3, "V"))
-                        self.temp_set_value(i, j, value)
-            return actions
-
-        # se é possível adicionar um barco de tamanho 2
-        if (2 in self.available_boats):
-            for i in range(10):
-                for j in range(10):
-                    value = self.get_value(i, j)
-                    if value in ['.', 'W']:
-                        continue
-                    if (self.is_possible_to_add_boat(i, j, 2, "H")):
-                        actions.append((i, j, 2, "H"))
-                    if (self.is_possible_to_add_boat(i, j, 2, "V")):
-                        actions.append((i, j, 2, "V"))
-
-                    if (value == "T"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i+1, j, 1, "V")):
-                            actions.append((i, j, 2, "V"))
-                        self.temp_set_value(i, j, value)
-
-                    if (value == "B"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i - 1, j, 1, "V")):
-                            actions.append((i-1, j, 2, "V"))
-                        self.temp_set_value(i, j, value)
-
-                    if (value == "R"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i, j - 1, 1, "H")):
-                            actions.append((i, j-1, 2, "H"))
-                        self.temp_set_value(i, j, value)
-
-                    if (value == "L"):
-                        self.temp_set_value(i, j, " ")
-                        if (self.is_possible_to_add_boat(i, j + 1, 1, "H")):
-                            actions.append((i, j, 2, "H"))
-                        self.temp_set_value(i, j, value)
+        if self.is_valid == False or not self.available_boats:
             return actions
 
-        # se é possível adicionar um barco de tamanho 1
-        if (1 in self.available_boats):
-            for i in range(10):
-                for j in range(10):
-                    value = self.get_value(i, j)
-                    if value in ['.', 'W']:
-                        continue
-                    if (self.is_possible_to_add_boat(i, j, 1, "H")):
-                        actions.append((i, j, 1, "H"))
-            return actions
+        length = max(self.available_boats)
+        for i in range(self.size):
+            for j in range(self.size):
+                value = self.get_value(i, j)
+                if value in ['.', 'W']:
+                    continue
+                if (self.is_possible_to_add_boat(i, j, length, "H")):
+                    actions.append((i, j, length, "H"))
+                if length == 1:
+                    continue
+                if (self.is_possible_to_add_boat(i, j, length, "V")):
+                    actions.append((i, j, length, "V"))
+
+                # um barco pode completar uma hint que não seja um círculo
+                if value in ['T', 'B', 'R', 'L', 'M']:
+                    self.temp_set_value(i, j, " ")
+                    for action, boat in hint_extensions(i, j, value, length):
+                        if (self.is_possible_to_add_boat(*boat)):
+                            actions.append(action)
+                    self.temp_set_value(i, j, value)
         return actions
 
-    def add_boat_size_1(self, row: int, col: int) -> None:
-        """ Adiciona um barco de tamanho 1 na posição (row, col)."""
-        self.set_value(row, col, "c")
-        self.surround_circle(row, col)
-        self.available_boats.remove(1)
-
-    def add_boat_size_2_H(self, row: int, col: int) -> None:
-        """ Adiciona um barco de tamanho 2 na posição (row, col) com orientação horizontal."""
-        self.set_value(row, col, "l")
-        self.set_value(row, col + 1, "r")
-        self.surround_left(row, col)
-        self.surround_right(row, col + 1)
-        self.available_boats.remove(2)
-
-    def add_boat_size_2_V(self, row: int, col: int) -> None:
-        """ Adiciona um barco de tamanho 2 na posição (row, col) com orientação vertical."""
-        self.set_value(row, col, "t")
-        self.set_value(row + 1, col, "b")
-        self.surround_top(row, col)
-        self.surround_bottom(row + 1, col)
-        self.available_boats.remove(2)
-
-    def add_boat_size_3_H(self, row: int, col: int) -> None:
-        """ Adiciona um barco de tamanho 3 na posição (row, col) com orientação horizontal."""
-        self.set_value(row, col, "l")
-        self.set_value(row, col + 1, "m")
-        self.set_value(row, col + 2, "r")
-        self.surround_left(row, col)
-        self.surround_middle(row, col + 1)
-        self.surround_right(row, col + 2)
-        self.available_boats.remove(3)
-
-    def add_boat_size_3_V(self, row: int, col: int) -> None:
-        """ Adiciona um barco de tamanho 3 na posição (row, col) com orientação vertical."""
-        self.set_value(row, col, "t")
-        self.set_value(row + 1, col, "m")
-        self.set_value(row + 2, col, "b")
-        self.surround_top(row, col)
-        self.surround_middle(row + 1, col)
-        self.surround_bottom(row + 2, col)
-        self.available_boats.remove(3)
-
-    def add_boat_size_4_H(self, row: int, col: int) -> None:
-        """ Adiciona um barco de tamanho 4 na posição (row, col) com orientação horizontal. """
-        self.set_value(row, col, "l")
-        self.set_value(row, col + 1, "m")
-        self.set_value(row, col + 2, "m")
-        self.set_value(row, col + 3, "r")
-        self.surround_left(row, col)
-        self.surround_middle(row, col + 1)
-        self.surround_middle(row, col + 2)
-        self.surround_right(row, col + 3)
-        self.available_boats.remove(4)
-
-    def add_boat_size_4_V(self, row: int, col: int) -> None:
-        """ Adiciona um barco de tamanho 4 na posição (row, col) com orientação vertical. """
-        self.set_value(row, col, "t")
-        self.set_value(row + 1, col, "m")
-        self.set_value(row + 2, col, "m")
-        self.set_value(row + 3, col, "b")
-        self.surround_top(row, col)
-        self.surround_middle(row + 1, col)
-        self.surround_middle(row + 2, col)
-        self.surround_bottom(row + 3, col)
-        self.available_boats.remove(4)
-
     def add_boat(self, row: int, col: int, length: int, orientation: str) -> None:
-        """ Adiciona um barco de tamanho 'length' na posição (row, col) com orientação 'orientation'."""
+        """ Adiciona um barco de tamanho 'length' na posição (row, col) com
+        orientação 'orientation' e preenche a sua vizinhança com água."""
+        if length not in self.available_boats:
+            raise ValueError("Invalid boat length")
         if length == 1:
-            self.add_boat_size_1(row, col)
-        elif length == 2:
-            if (orientation == "H"):
-                self.add_boat_size_2_H(row, col)
-            elif (orientation == "V"):
-                self.add_boat_size_2_V(row, col)
-        elif length == 3:
-            if (orientation == "H"):
-                self.add_boat_size_3_H(row, col)
-            elif (orientation == "V"):
-                self.add_boat_size_3_V(row, col)
-        elif length == 4:
-            if (orientation == "H"):
-                self.add_boat_size_4_H(row, col)
-            elif (orientation == "V"):
-                self.add_boat_size_4_V(row, col)
+            parts = "c"
+        elif orientation == "H":
+            parts = "l" + "m" * (length - 2) + "r"
         else:
-            raise ValueError("Invalid boat length")
+            parts = "t" + "m" * (length - 2) + "b"
+        positions = [(row, col + i) if orientation == "H" else (row + i, col)
+                     for i in range(length)]
+        for (i, j), part in zip(positions, parts):
+            self.set_value(i, j, part)
+        for (i, j), part in zip(positions, parts):
+            self.surround_hint_with_water(i, j, part.upper())
+        self.available_boats.remove(length)
 
     def check_valid(self) -> None:
-        """ Verifica se a instância é válida."""
-        for i in range(10):
-            for j in range(10):
-                if (self.get_value(i, j) not in [" ", ".", "W", "C", "c"]):
-                    if self.surrounded_by_water(i, j):
-                        self.is_valid = False
+        """ Verifica se a instância é válida. Só são verificadas as linhas,
+        colunas e vizinhanças das casas alteradas desde a última
+        verificação, pois as restantes não mudaram."""
+        rows = set()
+        cols = set()
+        cells = set()
+        for row, col in self.touched_cells:
+            rows.add(row)
+            cols.add(col)
+            for i in range(row - 1, row + 2):
+                for j in range(col - 1, col + 2):
+                    cells.add((i, j))
+        self.touched_cells = set()
+
+        for i, j in cells:
+            if (self.get_value(i, j) not in [" ", ".", "W", "C", "c", None]):
+                if self.surrounded_by_water(i, j):
+                    self.is_valid = False
+        for i in rows:
             if self.limit_rows[i] > self.available_rows[i] + self.current_boat_rows[i]:
                 self.is_valid = False
-            elif self.limit_columns[i] > self.available_cols[i] + self.current_boat_columns[i]:
+        for j in cols:
+            if self.limit_columns[j] > self.available_cols[j] + self.current_boat_columns[j]:
                 self.is_valid = False
 
     @staticmethod
-    def parse_instance() -> None:
-        """Lê o test do standard input (stdin) que é passado como argumento
-        e retorna uma instância da classe Board.
+    def parse_instance(source=None) -> "Board":
+        """Lê a instância de 'source' (ver read_instance), por omissão do
+        ficheiro input.txt, e retorna uma instância da classe Board.
         """
-        rows = []
-        columns = []
-        hints = []
-        
-        with open('input.txt', 'r') as f:
-            for line in f:
-                instance = line.split()
-                line = [int(x) if x.isdigit() else x for x in instance]
-                if not line:
-                    break
-                entry = line[0]
-                if entry == "ROW":
-                    rows = line[1:]
-                elif entry == "COLUMN":
-                    columns = line[1:]
-                elif entry == "HINT":
-                    hints.append(line[1:])
-
-
-        current_boat_rows = [0] * 10
-        current_boat_columns = [0] * 10
-        available_boats = [4, 3, 3, 2, 2, 2, 1, 1, 1, 1]
-        available_rows = [10] * 10
-        available_cols = [10] * 10
+        if source is None:
+            with open('input.txt', 'r') as f:
+                return Board.from_instance(read_instance(f))
+        return Board.from_instance(read_instance(source))
+
+    @staticmethod
+    def from_instance(instance: tuple) -> "Board":
+        """Cria o tabuleiro inicial da instância (rows, columns, hints, fleet)
+        devolvida por read_instance."""
+        rows, columns, hints, fleet = instance
+
+        size = len(rows)
+        current_boat_rows = [0] * size
+        current_boat_columns = [0] * size
+        available_boats = sorted(fleet, reverse=True)
+        available_rows = [size] * size
+        available_cols = [size] * size
         is_valid = True
         waters = 0
         cells = np.array([[' ' for x in range(len(rows))]
                           for y in range(len(columns))])
 
+        # a primeira verificação percorre o tabuleiro todo
+        touched_cells = {(i, j) for i in range(size) for j in range(size)}
+
         new_board = Board(cells, rows, columns, current_boat_rows, current_boat_columns,
-                          available_boats, available_rows, available_cols, is_valid, waters)
+                          available_boats, available_rows, available_cols, is_valid, waters,
+                          touched_cells, 0)
 
         # adiciona hints e remove barcos se estiverem inteiros
         for hint in hints:
             row, col, value = hint[0], hint[1], hint[2]
             new_board.set_value(row, col, value)
-            # tamanho 1
-            if value == 'C':
-                new_board.available_boats.remove(1)
-            # tamanho 2
-            if value == 'T':
-                if [row + 1, col, "B"] in hints:
-                    new_board.available_boats.remove(2)
-            if value == 'R':
-                if [row, col - 1, "L"] in hints:
-                    new_board.available_boats.remove(2)
-            if value == 'M':
-                # tamanho 3
-                if [row, col - 1, "L"] in hints and [row, col + 1, "R"] in hints:
-                    new_board.available_boats.remove(3)
-                if [row - 1, col, "T"] in hints and [row + 1, col, "B"] in hints:
-                    new_board.available_boats.remove(3)
-                # tamanho 4
-                if [row, col - 1, "L"] in hints and [row, col + 1, "M"] in hints and [row, col + 2, "R"] in hints:
-                    new_board.available_boats.remove(4)
-                if [row - 1, col, "T"] in hints and [row + 1, col, "M"] in hints and [row + 2, col, "B"] in hints:
-                    new_board.available_boats.remove(4)
+        for boat in hinted_boats({(row, col): value for row, col, value in hints}):
+            new_board.available_boats.remove(len(boat))
         # preencher as linhas/colunas que já estão cheias
         new_board.fill_exausted_rows_cols()
 
@@ -636,24 +603,859 @@ class Board:
         # return str(c.parse_to_debug(new_board.cells))
 
         board = ""
-        for i in range(10):
-            for j in range(10):
+        for i in range(self.size):
+            for j in range(self.size):
                 board += self.get_value(i, j)
             board += "\n"
         return board[:-1]
 
 
+# ______________________________________________________________________________
+# Tabuleiro representado por máscaras de bits
+
+# Geometria de um tabuleiro de lado 'size', onde a casa (row, col)
+# corresponde ao bit row * size + col: a máscara de todas as casas, as das
+# linhas e colunas, as casas cuja vizinha à esquerda / à direita não sai do
+# tabuleiro e as vizinhanças (até 8 casas) de cada casa.
+Geometry = namedtuple('Geometry', ['size', 'full', 'rows', 'columns',
+                                   'not_first', 'not_last', 'neighbours'])
+
+
+def cell_bit(row: int, col: int, size: int) -> int:
+    """Devolve o bit correspondente à casa (row, col)."""
+    return 1 << (row * size + col)
+
+
+@functools.lru_cache(maxsize=None)
+def geometry(size: int) -> Geometry:
+    """Devolve a geometria de um tabuleiro de lado 'size' (calculada uma
+    única vez por tamanho)."""
+    full = (1 << size * size) - 1
+    rows = tuple(((1 << size) - 1) << (size * row) for row in range(size))
+    columns = tuple(sum(1 << (size * row + col) for row in range(size))
+                    for col in range(size))
+    neighbours = []
+    for row in range(size):
+        for col in range(size):
+            mask = 0
+            for i in range(row - 1, row + 2):
+                for j in range(col - 1, col + 2):
+                    if (i, j) != (row, col) and 0 <= i < size and 0 <= j < size:
+                        mask |= cell_bit(i, j, size)
+            neighbours.append(mask)
+    return Geometry(size, full, rows, columns, full & ~columns[0],
+                    full & ~columns[-1], tuple(neighbours))
+
+
+def diagonal_mask(mask: int, geometry: Geometry) -> int:
+    """Devolve a máscara das casas na diagonal de alguma casa de 'mask'."""
+    size = geometry.size
+    return (((mask << (size + 1)) & geometry.not_first) |
+            ((mask << (size - 1)) & geometry.not_last) |
+            ((mask >> (size - 1)) & geometry.not_first) |
+            ((mask >> (size + 1)) & geometry.not_last)) & geometry.full
+
+
+def bit_indices(mask: int):
+    """Percorre os índices dos bits a 1 de 'mask'."""
+    while mask:
+        bit = mask & -mask
+        yield bit.bit_length() - 1
+        mask ^= bit
+
+
+@functools.lru_cache(maxsize=None)
+def boat_masks(row: int, col: int, length: int, orientation: str,
+               size: int) -> (int, int):
+    """Devolve as máscaras das casas ocupadas por um barco e da sua
+    vizinhança (as casas que têm de ficar com água)."""
+    neighbour_masks = geometry(size).neighbours
+    cells = 0
+    neighbours = 0
+    for i in range(length):
+        if orientation == "H":
+            index = row * size + col + i
+        else:
+            index = (row + i) * size + col
+        cells |= 1 << index
+        neighbours |= neighbour_masks[index]
+    return cells, neighbours & ~cells
+
+
+# Uma colocação possível de um barco. 'cells' são as casas que têm de estar
+# por preencher, 'neighbours' as que não podem ter barcos e 'line' a linha
+# (barcos horizontais) ou coluna (verticais) onde o barco é contado, que não
+# pode ter mais do que 'capacity' barcos antes de o barco ser colocado.
+# 'footprint' são todas as casas do barco, incluindo as hints que cobre.
+Placement = namedtuple('Placement',
+                       ['action', 'cells', 'neighbours', 'line', 'capacity',
+                        'footprint'])
+
+
+def hint_extensions(row: int, col: int, value: str, length: int) -> list:
+    """Devolve os pares (ação, barco a verificar) dos barcos de tamanho
+    'length' que completam a hint 'value' na posição (row, col)."""
+    if value == "T":
+        return [((row, col, length, "V"), (row + 1, col, length - 1, "V"))]
+    if value == "B":
+        top = row - length + 1
+        return [((top, col, length, "V"), (top, col, length - 1, "V"))]
+    if value == "R":
+        left = col - length + 1
+        return [((row, left, length, "H"), (row, left, length - 1, "H"))]
+    if value == "L":
+        return [((row, col, length, "H"), (row, col + 1, length - 1, "H"))]
+    if value == "M":
+        boats = [(row, col - k, length, "H") for k in range(1, length - 1)] + \
+                [(row - k, col, length, "V") for k in range(1, length - 1)]
+        return [(boat, boat) for boat in boats]
+    return []
+
+
+def make_placement(action: tuple, boat: tuple, blank: int, rows: list,
+                   columns: list) -> Placement:
+    """Cria a colocação da 'action', verificada através do barco 'boat' com
+    a casa 'blank' tratada como vazia. Devolve None se a colocação nunca
+    for possível nesta instância."""
+    row, col, length, orientation = boat
+    size = len(rows)
+    if row < 0 or col < 0:
+        return None
+    if orientation == "H":
+        if col + length > size:
+            return None
+        line, limit = geometry(size).rows[row], rows[row]
+    else:
+        if row + length > size:
+            return None
+        line, limit = geometry(size).columns[col], columns[col]
+    if limit < length:
+        return None
+    cells, neighbours = boat_masks(row, col, length, orientation, size)
+    return Placement(action, cells & ~blank, neighbours & ~blank,
+                     line & ~blank, limit - length, cells)
+
+
+def make_covering_placement(row: int, col: int, length: int, orientation: str,
+                            rows: list, columns: list, hints: dict) -> Placement:
+    """Cria a colocação de um barco que pode cobrir quaisquer hints, desde
+    que cada hint coberta corresponda à parte do barco que lá fica. Devolve
+    None se a colocação nunca for possível nesta instância."""
+    size = len(rows)
+    if orientation == "H":
+        if col + length > size:
+            return None
+        positions = [(row, col + k) for k in range(length)]
+        parts = "L" + "M" * (length - 2) + "R"
+        line, limit = geometry(size).rows[row], rows[row]
+    else:
+        if row + length > size:
+            return None
+        positions = [(row + k, col) for k in range(length)]
+        parts = "T" + "M" * (length - 2) + "B"
+        line, limit = geometry(size).columns[col], columns[col]
+    if length == 1:
+        parts = "C"
+    if limit < length:
+        return None
+    covered = 0
+    for (i, j), part in zip(positions, parts):
+        value = hints.get((i, j))
+        if value is not None:
+            if value != part:
+                return None
+            covered |= cell_bit(i, j, size)
+    cells, neighbours = boat_masks(row, col, length, orientation, size)
+    # os barcos dados inteiros nas hints já foram retirados da frota
+    if covered == cells:
+        return None
+    return Placement((row, col, length, orientation), cells & ~covered,
+                     neighbours, line & ~covered, limit - length, cells)
+
+
+def hinted_boats_mask(hints: dict, size: int) -> int:
+    """Devolve a máscara das hints que formam barcos inteiros, que já foram
+    retirados da frota ao ler a instância."""
+    mask = 0
+    for boat in hinted_boats(hints):
+        for row, col in boat:
+            mask |= cell_bit(row, col, size)
+    return mask
+
+
+def build_placement_table(rows: list, columns: list, hints: dict,
+                          lengths, cover_hints: bool = False) -> dict:
+    """Constrói, para cada tamanho de barco em 'lengths', a lista de
+    colocações possíveis na instância, pela ordem em que a classe Board gera
+    as ações. Com 'cover_hints', um barco pode cobrir várias hints ao mesmo
+    tempo (algo que a classe Board não permite)."""
+    size = len(rows)
+    table = {}
+    for length in sorted(set(lengths)):
+        placements = []
+        for i in range(size):
+            for j in range(size):
+                value = hints.get((i, j))
+                if cover_hints:
+                    for orientation in (["H"] if length == 1 else ["H", "V"]):
+                        placement = make_covering_placement(
+                            i, j, length, orientation, rows, columns, hints)
+                        if placement is not None:
+                            placements.append(placement)
+                    continue
+                if value is None:
+                    candidates = [((i, j, length, "H"), (i, j, length, "H"), 0)]
+                    if length > 1:
+                        candidates.append(((i, j, length, "V"), (i, j, length, "V"), 0))
+                elif length > 1:
+                    candidates = [(action, boat, cell_bit(i, j, size)) for action, boat
+                                  in hint_extensions(i, j, value, length)]
+                else:
+                    candidates = []
+                for action, boat, blank in candidates:
+                    placement = make_placement(action, boat, blank, rows, columns)
+                    if placement is not None:
+                        placements.append(placement)
+        table[length] = tuple(placements)
+    return table
+
+
+class BitBoard:
+    """Representação de um tabuleiro de Bimaru através de máscaras de bits.
+    Tem a mesma interface que a classe Board, mas as casas com barco, com
+    água e por preencher são guardadas em três inteiros com um bit por casa
+    (ver Geometry), pelo
+    que copiar o tabuleiro e verificar vizinhanças são operações sobre
+    inteiros."""
+
+    def __init__(self, boat_mask: int, water_mask: int, unknown_mask: int,
+                 available_boats: tuple, is_valid: bool, rows: list,
+                 columns: list, hints: dict, hint_checks: tuple,
+                 placements: dict, changed_mask: int, forced_mask: int = 0):
+        """ Inicializa o tabuleiro com as máscaras dadas."""
+        self.boat_mask = boat_mask
+        self.water_mask = water_mask
+        self.unknown_mask = unknown_mask
+        self.available_boats = available_boats
+        self.is_valid = is_valid
+        # partilhados por todos os tabuleiros da mesma instância
+        self.limit_rows = rows
+        self.limit_columns = columns
+        self.hints = hints
+        self.hint_checks = hint_checks
+        self.placements = placements
+        self.geometry = geometry(len(rows))
+        self.size = self.geometry.size
+        # casas alteradas desde a última chamada a check_valid
+        self.changed_mask = changed_mask
+        # casas com barco deduzidas pela propagação (ou hints) ainda não
+        # cobertas por um barco colocado (estão também em boat_mask)
+        self.forced_mask = forced_mask
+
+    def deepcopy(self, board):
+        """ Retorna uma cópia do tabuleiro."""
+        return BitBoard(board.boat_mask, board.water_mask, board.unknown_mask,
+                        board.available_boats, board.is_valid,
+                        board.limit_rows, board.limit_columns, board.hints,
+                        board.hint_checks, board.placements,
+                        board.changed_mask, board.forced_mask)
+
+    def key(self) -> tuple:
+        """Chave de transposição do tabuleiro: as próprias máscaras."""
+        return (self.boat_mask, self.water_mask, self.forced_mask,
+                self.available_boats)
+
+    def __eq__(self, other):
+        return isinstance(other, BitBoard) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    @property
+    def current_boat_rows(self) -> list:
+        return [(self.boat_mask & mask).bit_count() for mask in self.geometry.rows]
+
+    @property
+    def current_boat_columns(self) -> list:
+        return [(self.boat_mask & mask).bit_count() for mask in self.geometry.columns]
+
+    @property
+    def available_rows(self) -> list:
+        return [(self.unknown_mask & mask).bit_count() for mask in self.geometry.rows]
+
+    @property
+    def available_cols(self) -> list:
+        return [(self.unknown_mask & mask).bit_count() for mask in self.geometry.columns]
+
+    @property
+    def waters(self) -> int:
+        """Número de casas com água que não são hints."""
+        return self.water_mask.bit_count() - list(self.hints.values()).count('W')
+
+    @property
+    def cells(self) -> list:
+        """Devolve o tabuleiro como uma lista de strings, uma por linha."""
+        return [''.join(self.get_value(i, j) for j in range(self.size))
+                for i in range(self.size)]
+
+    def valid_cell(self, row: int, col: int) -> bool:
+        """Verifica se a célula é válida."""
+        return 0 <= row < self.size and 0 <= col < self.size
+
+    def get_value(self, row: int, col: int) -> str:
+        """Devolve o valor na respetiva posição do tabuleiro."""
+        if not self.valid_cell(row, col):
+            return None
+        if (row, col) in self.hints:
+            return self.hints[(row, col)]
+        bit = cell_bit(row, col, self.size)
+        if self.water_mask & bit:
+            return '.'
+        if self.unknown_mask & bit:
+            return ' '
+        # as partes de um barco deduzem-se a partir das casas vizinhas
+        left = col > 0 and self.boat_mask & (bit >> 1)
+        right = col < self.size - 1 and self.boat_mask & (bit << 1)
+        up = self.boat_mask & (bit >> self.size)
+        down = self.boat_mask & (bit << self.size)
+        if (left and right) or (up and down):
+            return 'm'
+        if right:
+            return 'l'
+        if left:
+            return 'r'
+        if down:
+            return 't'
+        if up:
+            return 'b'
+        return 'c'
+
+    def set_value(self, row: int, col: int, value: str) -> None:
+        """Atribui o valor na respetiva posição do tabuleiro."""
+        if not self.valid_cell(row, col):
+            return
+        bit = cell_bit(row, col, self.size)
+        if self.unknown_mask & bit:
+            self.unknown_mask &= ~bit
+            self.changed_mask |= bit
+            if value in ['W', '.']:
+                self.water_mask |= bit
+            else:
+                self.boat_mask |= bit
+
+    def fill_row_with_water(self, row: int) -> None:
+        """Preenche a linha 'row' com água."""
+        self.water_mask |= self.unknown_mask & self.geometry.rows[row]
+        self.changed_mask |= self.unknown_mask & self.geometry.rows[row]
+        self.unknown_mask &= ~self.geometry.rows[row]
+
+    def fill_column_with_water(self, col: int) -> None:
+        """Preenche a coluna 'col' com água."""
+        self.water_mask |= self.unknown_mask & self.geometry.columns[col]
+        self.changed_mask |= self.unknown_mask & self.geometry.columns[col]
+        self.unknown_mask &= ~self.geometry.columns[col]
+
+    def is_possible_to_add_boat(self, row: int, col: int, length: int,
+                                orientation: str, blank: int = 0) -> bool:
+        """ Verifica se é possível adicionar um barco de tamanho 'length' na
+        posição (row, col) com orientação 'orientation'. A casa 'blank' é
+        tratada como vazia (equivale ao temp_set_value da classe Board)."""
+        if not self.valid_cell(row, col):
+            return False
+        boats = self.boat_mask & ~blank
+        if (orientation == "H"):
+            # se o barco não cabe no tabuleiro ou excede o limite da linha
+            if (col + length > self.size or self.limit_rows[row] <
+                    (boats & self.geometry.rows[row]).bit_count() + length):
+                return False
+        elif (orientation == "V"):
+            # se o barco não cabe no tabuleiro ou excede o limite da coluna
+            if (row + length > self.size or self.limit_columns[col] <
+                    (boats & self.geometry.columns[col]).bit_count() + length):
+                return False
+        cells, neighbours = boat_masks(row, col, length, orientation, self.size)
+        # se as posições do barco estão livres e não há barcos à volta
+        return not (cells & ~(self.unknown_mask | blank) or neighbours & boats)
+
+    def valid_placements(self, length: int) -> list:
+        """Devolve as colocações de barcos de tamanho 'length' da tabela que
+        são possíveis no tabuleiro atual."""
+        # as casas deduzidas como barco podem ser cobertas por um barco novo
+        free = self.unknown_mask | self.forced_mask
+        boats = self.boat_mask
+        return [placement for placement in self.placements[length]
+                if not (placement.cells & ~free or placement.neighbours & boats or
+                        (boats & placement.line & ~placement.cells).bit_count()
+                        > placement.capacity)]
+
+    def largest_boat(self) -> int:
+        """Devolve o tamanho do maior barco que ainda falta colocar."""
+        return max(self.available_boats, default=None)
+
+    def get_possible_actions(self) -> list:
+        """ Retorna uma lista de ações possíveis, pela mesma ordem que a
+        classe Board, filtrando a tabela de colocações da instância."""
+        length = self.largest_boat()
+        if self.is_valid == False or length is None:
+            return []
+        return [placement.action for placement in self.valid_placements(length)]
+
+    def get_forcing_actions(self) -> list:
+        """ Retorna as mesmas ações que get_possible_actions, ordenadas pelo
+        número de casas por preencher que cada barco decide (as suas e as da
+        vizinhança). As que decidem mais casas ficam no fim da lista, para
+        serem as primeiras a ser exploradas pela procura em profundidade."""
+        length = self.largest_boat()
+        if self.is_valid == False or length is None:
+            return []
+        unknown = self.unknown_mask
+        placements = sorted(self.valid_placements(length), key=lambda placement:
+                            ((placement.footprint | placement.neighbours)
+                             & unknown).bit_count())
+        return [placement.action for placement in placements]
+
+    def get_most_constrained_actions(self) -> list:
+        """ Retorna as ações de qualquer tamanho que cobrem a casa ou a linha
+        mais restringida. Escolhe-se a casa com barco por cobrir (ver
+        forced_mask) com menos colocações que a cubram ou, se não houver
+        nenhuma, a linha ou coluna a que faltam barcos com menos colocações
+        que a intersetem. Um destes barcos tem de estar na solução."""
+        if self.is_valid == False:
+            return []
+        placements = [placement
+                      for length in sorted(set(self.available_boats), reverse=True)
+                      for placement in self.valid_placements(length)]
+        best = None
+        forced = self.forced_mask
+        while forced:
+            bit = forced & -forced
+            forced ^= bit
+            covering = [placement for placement in placements
+                        if placement.footprint & bit]
+            if best is None or len(covering) < len(best):
+                best = covering
+                if not best:
+                    return []
+        if best is None:
+            for lines, limits in ((self.geometry.rows, self.limit_rows),
+                                  (self.geometry.columns, self.limit_columns)):
+                for line, limit in zip(lines, limits):
+                    if (self.boat_mask & line).bit_count() == limit:
+                        continue
+                    crossing = [placement for placement in placements
+                                if placement.footprint & line]
+                    if best is None or len(crossing) < len(best):
+                        best = crossing
+                        if not best:
+                            return []
+        if best is None:
+            return []
+        return [placement.action for placement in best]
+
+    def add_boat(self, row: int, col: int, length: int, orientation: str) -> None:
+        """ Adiciona um barco de tamanho 'length' na posição (row, col) com
+        orientação 'orientation' e preenche a sua vizinhança com água."""
+        if length not in self.available_boats:
+            raise ValueError("Invalid boat length")
+        cells, neighbours = boat_masks(row, col, length, orientation, self.size)
+        self.boat_mask |= cells & self.unknown_mask
+        self.forced_mask &= ~cells
+        self.water_mask |= neighbours & self.unknown_mask
+        self.changed_mask |= (cells | neighbours) & self.unknown_mask
+        self.unknown_mask &= ~(cells | neighbours)
+        index = self.available_boats.index(length)
+        self.available_boats = self.available_boats[:index] + \
+            self.available_boats[index + 1:]
+
+    def fill_exhausted_around_boat(self, row: int, col: int, length: int, orientation: str) -> None:
+        """Preenche as linhas e colunas que ja estao cheias e que intersetam o barco."""
+        if orientation == "H":
+            rows, columns = [row], range(col, col + length)
+        else:
+            rows, columns = range(row, row + length), [col]
+        for i in rows:
+            if (self.boat_mask & self.geometry.rows[i]).bit_count() == self.limit_rows[i]:
+                self.fill_row_with_water(i)
+        for j in columns:
+            if (self.boat_mask & self.geometry.columns[j]).bit_count() == self.limit_columns[j]:
+                self.fill_column_with_water(j)
+
+    def force_ships(self, mask: int) -> None:
+        """Marca as casas por preencher de 'mask' como tendo barco."""
+        mask &= self.unknown_mask
+        self.boat_mask |= mask
+        self.forced_mask |= mask
+        self.changed_mask |= mask
+        self.unknown_mask &= ~mask
+
+    def force_waters(self, mask: int) -> None:
+        """Marca as casas por preencher de 'mask' como tendo água."""
+        mask &= self.unknown_mask
+        self.water_mask |= mask
+        self.changed_mask |= mask
+        self.unknown_mask &= ~mask
+
+    def propagate_lines(self) -> None:
+        """Enche de água as linhas e colunas completas e de barcos aquelas
+        em que todas as casas por preencher têm de ter barco."""
+        for lines, limits in ((self.geometry.rows, self.limit_rows),
+                              (self.geometry.columns, self.limit_columns)):
+            for line, limit in zip(lines, limits):
+                unknown = self.unknown_mask & line
+                missing = limit - (self.boat_mask & line).bit_count()
+                if missing < 0 or missing > unknown.bit_count():
+                    self.is_valid = False
+                    return
+                if missing == 0:
+                    self.force_waters(unknown)
+                elif missing == unknown.bit_count():
+                    self.force_ships(unknown)
+
+    def propagate_hints(self) -> None:
+        """Estende as hints T, B, L, R e M às casas que têm de ter barco."""
+        for (row, col), value in self.hints.items():
+            if value not in ['T', 'B', 'L', 'R', 'M']:
+                continue
+            up = cell_bit(row - 1, col, self.size) if row > 0 else 0
+            down = cell_bit(row + 1, col, self.size) if row < self.size - 1 else 0
+            left = cell_bit(row, col - 1, self.size) if col > 0 else 0
+            right = cell_bit(row, col + 1, self.size) if col < self.size - 1 else 0
+            if value == 'T':
+                ships = [down]
+            elif value == 'B':
+                ships = [up]
+            elif value == 'L':
+                ships = [right]
+            elif value == 'R':
+                ships = [left]
+            else:
+                # o meio de um barco é horizontal se tiver barco à esquerda
+                # ou à direita ou se tiver água (ou o limite) acima ou abaixo
+                closed = self.water_mask
+                horizontal = any(bit & self.boat_mask for bit in (left, right)) \
+                    or any(not bit or bit & closed for bit in (up, down))
+                vertical = any(bit & self.boat_mask for bit in (up, down)) \
+                    or any(not bit or bit & closed for bit in (left, right))
+                if horizontal and vertical:
+                    self.is_valid = False
+                    return
+                if horizontal:
+                    ships = [left, right]
+                    self.force_waters(up | down)
+                elif vertical:
+                    ships = [up, down]
+                    self.force_waters(left | right)
+                else:
+                    ships = []
+            for bit in ships:
+                if not bit or bit & self.water_mask:
+                    self.is_valid = False
+                    return
+                self.force_ships(bit)
+
+    def enable_propagation(self) -> None:
+        """Prepara o tabuleiro para a propagação de restrições e propaga-as.
+        As colocações passam a poder cobrir várias hints, pois a propagação
+        pode deduzir barcos que só assim ficam completos. As hints de barcos
+        que não estão inteiros contam como casas por cobrir (forced_mask).
+        """
+        self.placements = build_placement_table(
+            self.limit_rows, self.limit_columns, self.hints,
+            self.available_boats, cover_hints=True)
+        ships = 0
+        for (row, col), value in self.hints.items():
+            if value != 'W':
+                ships |= cell_bit(row, col, self.size)
+        self.forced_mask |= ships & ~hinted_boats_mask(self.hints, self.size)
+        self.propagate()
+
+    def propagate(self) -> None:
+        """Aplica as regras de inferência até atingir um ponto fixo: linhas e
+        colunas completas ficam com água, linhas e colunas que precisam de
+        todas as casas livres ficam com barco, as hints são estendidas e as
+        diagonais de todas as casas com barco ficam com água."""
+        previous = None
+        while self.is_valid and previous != (self.boat_mask, self.water_mask):
+            previous = (self.boat_mask, self.water_mask)
+            self.propagate_lines()
+            if not self.is_valid:
+                return
+            self.propagate_hints()
+            diagonals = diagonal_mask(self.boat_mask, self.geometry)
+            if diagonals & self.boat_mask:
+                self.is_valid = False
+                return
+            self.force_waters(diagonals)
+
+    def check_valid(self) -> None:
+        """ Verifica se a instância é válida. Só são verificadas as hints,
+        linhas e colunas que intersetam as casas alteradas desde a última
+        verificação."""
+        changed = self.changed_mask
+        if not changed:
+            return
+        self.changed_mask = 0
+        # uma hint que não é um círculo não pode estar rodeada de água
+        for neighbours in self.hint_checks:
+            if neighbours & changed and not neighbours & ~self.water_mask:
+                self.is_valid = False
+                return
+        free = self.boat_mask | self.unknown_mask
+        for i in range(self.size):
+            if (changed & self.geometry.rows[i] and
+                    self.limit_rows[i] > (free & self.geometry.rows[i]).bit_count()):
+                self.is_valid = False
+                return
+            if (changed & self.geometry.columns[i] and
+                    self.limit_columns[i] > (free & self.geometry.columns[i]).bit_count()):
+                self.is_valid = False
+                return
+
+    @staticmethod
+    def from_board(board: Board) -> "BitBoard":
+        """Converte um tabuleiro da classe Board num BitBoard."""
+        size = board.size
+        boat_mask = water_mask = unknown_mask = 0
+        hints = {}
+        hint_checks = []
+        for i in range(size):
+            for j in range(size):
+                value = board.get_value(i, j)
+                bit = cell_bit(i, j, size)
+                if value == ' ':
+                    unknown_mask |= bit
+                elif value in ['.', 'W']:
+                    water_mask |= bit
+                else:
+                    boat_mask |= bit
+                if value.isupper():
+                    hints[(i, j)] = value
+                    if value not in ['W', 'C']:
+                        hint_checks.append(geometry(size).neighbours[i * size + j])
+        return BitBoard(boat_mask, water_mask, unknown_mask,
+                        tuple(board.available_boats), board.is_valid,
+                        board.limit_rows, board.limit_columns, hints,
+                        tuple(hint_checks),
+                        build_placement_table(board.limit_rows,
+                                              board.limit_columns, hints,
+                                              board.available_boats),
+                        geometry(size).full)
+
+    @staticmethod
+    def parse_instance(source=None) -> "BitBoard":
+        """Lê a instância como a classe Board e converte-a num BitBoard."""
+        return BitBoard.from_board(Board.parse_instance(source))
+
+    @staticmethod
+    def from_instance(instance: tuple) -> "BitBoard":
+        """Cria o BitBoard inicial da instância devolvida por read_instance."""
+        return BitBoard.from_board(Board.from_instance(instance))
+
+    def __str__(self) -> str:
+        """Retorna uma string que representa o tabuleiro."""
+        return "\n".join(self.cells)
+
+
+# Motores de tabuleiro disponíveis
+ENGINES = {
+    "numpy": Board,
+    "bitboard": BitBoard,
+}
+
+# Políticas de ramificação: o método do tabuleiro que gera as ações
+BRANCHING = {
+    # o maior barco por colocar, em todas as posições possíveis
+    "largest": "get_possible_actions",
+    # o mesmo, explorando primeiro os barcos que decidem mais casas
+    "forcing": "get_forcing_actions",
+    # os barcos que cobrem a casa, linha ou coluna mais restringida; expande
+    # menos nós em algumas instâncias, mas cada nó custa mais e, no total, é
+    # muito mais lenta do que "largest" (45 vezes em 102 instâncias 10x10;
+    # não resolve as de 20x20 em 60 s)
+    "constrained": "get_most_constrained_actions",
+}
+
+
+def board_cells(board) -> str:
+    """Devolve as casas do tabuleiro, linha a linha, numa só string."""
+    size = board.size
+    return ''.join(board.get_value(i, j) for i in range(size) for j in range(size))
+
+
+class FullTrace(list):
+    """Registo dos passos da procura com cada tabuleiro gerado guardado
+    inteiro: é a lista desses tabuleiros."""
+
+    def __init__(self, board=None):
+        super().__init__()
+
+    def record(self, board, parent: BimaruState) -> int:
+        """Regista o tabuleiro 'board', gerado a partir do estado 'parent',
+        e devolve o número do passo."""
+        self.append(board)
+        return len(self) - 1
+
+
+class DeltaTrace:
+    """Registo dos passos da procura codificados como diferenças. As casas
+    do tabuleiro inicial são guardadas uma só vez (ver board_cells) e cada
+    passo guarda apenas o número do passo pai (-1 para o tabuleiro inicial)
+    e as casas (índice, valor) em que difere dele, numa string com um
+    carácter para o índice e outro para o valor de cada casa alterada."""
+
+    def __init__(self, board):
+        self.initial = board_cells(board)
+        self.parents = array('l')
+        self.changes = []
+        # os filhos de um nó são gerados seguidos, pelo que as casas do
+        # último pai são guardadas para não as calcular de novo
+        self.parent_step = -1
+        self.parent_cells = self.initial
+
+    def record(self, board, parent: BimaruState) -> int:
+        if parent.step != self.parent_step:
+            self.parent_step = parent.step
+            self.parent_cells = board_cells(parent.board)
+        return self.store(parent.step, self.diff(self.parent_cells,
+                                                 board_cells(board)))
+
+    @staticmethod
+    def diff(old_cells: str, cells: str) -> str:
+        """Devolve as casas em que 'cells' difere de 'old_cells'."""
+        return ''.join(chr(index) + value for index, (old, value)
+                       in enumerate(zip(old_cells, cells)) if old != value)
+
+    @classmethod
+    def from_path(cls, path: list) -> "DeltaTrace":
+        """Cria o registo só com os passos de um caminho da procura (a
+        lista de nós devolvida por Node.path), cada um pai do seguinte."""
+        trace = cls(path[0].state.board)
+        parent_cells = trace.initial
+        for node in path[1:]:
+            cells = board_cells(node.state.board)
+            trace.store(len(trace) - 1, cls.diff(parent_cells, cells))
+            parent_cells = cells
+        return trace
+
+    def store(self, parent: int, changes: str) -> int:
+        self.parents.append(parent)
+        self.changes.append(changes)
+        return len(self.parents) - 1
+
+    def __len__(self):
+        return len(self.parents)
+
+    @staticmethod
+    def group(changes: str) -> dict:
+        """Devolve as alterações de um passo como {valor: [índices]}."""
+        groups = {}
+        for k in range(0, len(changes), 2):
+            groups.setdefault(changes[k + 1], []).append(ord(changes[k]))
+        return groups
+
+    def to_json(self) -> dict:
+        """Devolve o registo como {"initial": casas, "steps": [[pai,
+        {valor: [índices]}], ...]}."""
+        return {"initial": self.initial,
+                "steps": [[parent, self.group(changes)] for parent, changes
+                          in zip(self.parents, self.changes)]}
+
+    def boards(self):
+        """Percorre as casas (ver board_cells) de cada passo, por ordem."""
+        decoded = []
+        for parent, changes in zip(self.parents, self.changes):
+            cells = list(self.initial if parent < 0 else decoded[parent])
+            for k in range(0, len(changes), 2):
+                cells[ord(changes[k])] = changes[k + 1]
+            decoded.append(''.join(cells))
+            yield decoded[-1]
+
+
+class NullTrace:
+    """Registo que não guarda os passos da procura, apenas os conta."""
+
+    def __init__(self, board=None):
+        self.count = 0
+
+    def record(self, board, parent: BimaruState) -> int:
+        self.count += 1
+        return self.count - 1
+
+    def __len__(self):
+        return self.count
+
+
+# Registos dos passos da procura disponíveis
+TRACES = {
+    "full": FullTrace,
+    "delta": DeltaTrace,
+    "none": NullTrace,
+}
+
+
 class Bimaru(Problem):
 
-    def __init__(self, board: Board):
-        """O construtor especifica o estado inicial."""
+    def __init__(self, board: Board, propagate: bool = False,
+                 transpositions: int = 0, symmetry_breaking: bool = False,
+                 branching: str = "largest", trace="full"):
+        """O construtor especifica o estado inicial. Se 'propagate' for
+        verdadeiro, as restrições são propagadas no tabuleiro inicial e
+        depois de cada barco colocado (requer o motor bitboard). Se
+        'transpositions' for positivo, os estados já expandidos são
+        guardados numa tabela de transposição com esse tamanho máximo e
+        não voltam a ser expandidos; só serve para procuras que expandem
+        cada estado uma única vez (ver TRANSPOSITION_SOLVERS), já que a
+        segunda expansão de um estado não tem sucessores. Com
+        'symmetry_breaking', um barco só pode ser colocado numa posição
+        lexicograficamente posterior à do último barco do mesmo tamanho,
+        pelo que cada conjunto de barcos iguais é gerado uma única vez. 'branching' é a política de
+        ramificação (ver BRANCHING); só "largest" existe na classe Board.
+        Os tabuleiros gerados são registados em self.steps, criado por
+        'trace' a partir do tabuleiro inicial: o nome de um registo em
+        TRACES ou uma função que devolva um objeto com o método record (ver
+        FullTrace), por exemplo para os enviar à medida que a procura
+        avança."""
+        if propagate and not isinstance(board, BitBoard):
+            raise ValueError("Constraint propagation requires a BitBoard")
+        if branching not in BRANCHING:
+            raise ValueError(f"Unknown branching policy: {branching}")
+        if isinstance(trace, str) and trace not in TRACES:
+            raise ValueError(f"Unknown trace: {trace}")
+        if not hasattr(board, BRANCHING[branching]):
+            raise ValueError(f"Branching policy '{branching}' requires a BitBoard")
+        # a quebra de simetria assume que os barcos são colocados por
+        # tamanho decrescente
+        if symmetry_breaking and branching == "constrained":
+            raise ValueError("Symmetry breaking requires boats to be placed "
+                             "by decreasing size")
+        self.propagate = propagate
+        self.branching = BRANCHING[branching]
+        self.symmetry_breaking = symmetry_breaking
+        if propagate:
+            board.enable_propagation()
+        self.transpositions = None
+        if transpositions:
+            self.transpositions = TranspositionTable(transpositions)
         self.initial = BimaruState(board)
-        self.steps = []
+        self.steps = (TRACES[trace] if isinstance(trace, str) else trace)(board)
 
     def actions(self, state: BimaruState):
         """Retorna uma lista de ações que podem ser executadas a
         partir do estado passado como argumento."""
-        return state.board.get_possible_actions()
+        if self.transpositions is not None:
+            # o mesmo tabuleiro pode ser obtido colocando os barcos por
+            # outra ordem; a sua subárvore já foi explorada
+            key = state.board.key()
+            if key in self.transpositions:
+                return []
+            self.transpositions.add(key)
+        actions = getattr(state.board, self.branching)()
+        if self.symmetry_breaking and actions:
+            last = state.last_boats.get(actions[0][2])
+            if last is not None:
+                actions = [action for action in actions
+                           if (action[0], action[1], action[3]) > last]
+        return actions
 
     def result(self, state: BimaruState, action):
         """Retorna o estado resultante de executar a 'action' sobre
@@ -664,22 +1466,123 @@ class Bimaru(Problem):
         row, col, length, orientation = action
         new_board.add_boat(row, col, length, orientation)
         new_board.fill_exhausted_around_boat(row, col, length, orientation)
+        if self.propagate:
+            new_board.propagate()
         new_board.check_valid()
-        self.steps.append(new_board.cells)
-        return BimaruState(new_board)
+        step = self.steps.record(new_board, state)
+        last_boats = state.last_boats
+        if self.symmetry_breaking:
+            last_boats = dict(last_boats)
+            last_boats[length] = (row, col, orientation)
+        return BimaruState(new_board, last_boats, step)
 
     def goal_test(self, state: BimaruState):
         """Retorna True se e só se o estado passado como argumento é
         um estado objetivo. Deve verificar se todas as posições do tabuleiro
         estão preenchidas de acordo com as regras do problema."""
         return state.board.current_boat_rows == state.board.limit_rows and \
-            state.board.current_boat_columns == state.board.limit_columns
+            state.board.current_boat_columns == state.board.limit_columns and \
+            not state.board.forced_mask
+
+    def exact_cover(self):
+        """Formula o problema como uma cobertura exata para a função
+        exact_cover_search. Cada opção é a colocação de um barco e usa o seu
+        tamanho uma vez, a linha e a coluna de cada uma das suas casas e as
+        casas por cobrir (forced_mask) em que fica. Os itens secundários são
+        os quadrados 2x2 que o barco toca: dois barcos que se toquem ou
+        sobreponham partilham um deles."""
+        if not isinstance(self.initial.board, BitBoard):
+            raise ValueError("Exact cover search requires a BitBoard")
+        board = self.initial.board.deepcopy(self.initial.board)
+        if not self.propagate:
+            board.enable_propagation()
+        # os barcos inteiros dados nas hints já contam para as linhas
+        placed = board.boat_mask & ~board.forced_mask
+        geometry = board.geometry
+        demands = {}
+        for length in board.available_boats:
+            demands[("boat", length)] = board.available_boats.count(length)
+        for i in range(board.size):
+            demands[("row", i)] = \
+                board.limit_rows[i] - (placed & geometry.rows[i]).bit_count()
+            demands[("column", i)] = \
+                board.limit_columns[i] - (placed & geometry.columns[i]).bit_count()
+        for index in bit_indices(board.forced_mask):
+            demands[("cell", index)] = 1
+        primary = list(demands)
+
+        options = []
+        lengths = sorted(set(board.available_boats), reverse=True)
+        for placement in (placement for length in lengths if board.is_valid
+                          for placement in board.valid_placements(length)):
+            row, col, length, orientation = placement.action
+            if orientation == "H":
+                positions = [(row, col + k) for k in range(length)]
+            else:
+                positions = [(row + k, col) for k in range(length)]
+            option = {("boat", length): 1}
+            for i, j in positions:
+                option[("row", i)] = option.get(("row", i), 0) + 1
+                option[("column", j)] = option.get(("column", j), 0) + 1
+                if board.forced_mask & cell_bit(i, j, board.size):
+                    option[("cell", i * board.size + j)] = 1
+                for block in ((i - 1, j - 1), (i - 1, j), (i, j - 1), (i, j)):
+                    option[("block",) + block] = 1
+                    demands[("block",) + block] = 1
+            options.append((placement.action, option))
+        return demands, primary, options
+
+    def sat_encoding(self):
+        """Codifica o problema numa fórmula para a função sat_search. Há uma
+        variável por casa (tem barco) e uma por colocação possível de um
+        barco, que implica as suas casas com barco e a vizinhança com água.
+        Cada casa com barco por preencher é coberta por alguma colocação, o
+        número de barcos de cada tamanho é o da frota e o número de casas
+        com barco de cada linha e coluna é o limite dado."""
+        if not isinstance(self.initial.board, BitBoard):
+            raise ValueError("SAT encoding requires a BitBoard")
+        board = self.initial.board.deepcopy(self.initial.board)
+        if not self.propagate:
+            board.enable_propagation()
+        cnf = CNF()
+        geometry = board.geometry
+        ships = [cnf.new_var() for _ in range(board.size * board.size)]
+        for index in bit_indices(board.water_mask):
+            cnf.add([-ships[index]])
+        for index in bit_indices(board.boat_mask):
+            cnf.add([ships[index]])
+
+        actions = {}
+        covering = {index: [] for index in range(len(ships))}
+        boats = {length: [] for length in board.available_boats}
+        for length in sorted(boats, reverse=True):
+            for placement in board.valid_placements(length):
+                var = cnf.new_var()
+                # decidir primeiro onde ficam os barcos, como na procura
+                cnf.prefer(var)
+                actions[var] = placement.action
+                boats[length].append(var)
+                for index in bit_indices(placement.footprint):
+                    cnf.add([-var, ships[index]])
+                    covering[index].append(var)
+                for index in bit_indices(placement.neighbours):
+                    cnf.add([-var, -ships[index]])
+        # os barcos inteiros dados nas hints não são cobertos por colocações
+        for index in bit_indices(board.unknown_mask | board.forced_mask):
+            cnf.add([-ships[index]] + covering[index])
+        for length, placements in boats.items():
+            cnf.exactly(placements, board.available_boats.count(length))
+        for i in range(board.size):
+            cnf.exactly([ships[index] for index in bit_indices(geometry.rows[i])],
+                        board.limit_rows[i])
+            cnf.exactly([ships[index] for index in bit_indices(geometry.columns[i])],
+                        board.limit_columns[i])
+        if not board.is_valid:
+            cnf.add([])
+        return cnf, actions
 
     def h(self, node: Node):
         """Função heuristica utilizada para a procura A*."""
-        if node.action is None:
-            return np.inf
-
         x = node.state.board.available_rows
         y = node.state.board.limit_rows
         z = node.state.board.current_boat_rows
@@ -690,7 +1593,8 @@ class Bimaru(Problem):
         filled = 1
         filled_rows = node.state.board.available_rows
         filled_cols = node.state.board.available_cols
-        for i in range(10):
+        size = len(y)
+        for i in range(size):
             if x[i] == y[i] - z[i]:
                 heu += x[i]
             if x1[i] == y1[i] - z1[i]:
@@ -701,32 +1605,253 @@ class Bimaru(Problem):
                 filled += 1
         remaining_boats = max(len(node.state.board.available_boats), 1)
 
-        water_cells = node.state.board.waters  # alto é bom
+        # o tabuleiro inicial pode ainda não ter água
+        water_cells = max(node.state.board.waters, 1)  # alto é bom
         index_sum = 0  # alto é mau
-        for i in range(10):
+        for i in range(size):
             index_sum += node.state.board.limit_rows[i] - \
                 node.state.board.current_boat_rows[i]
-        empty_cells = 100 - water_cells - index_sum  # alto é mau
+        empty_cells = size * size - water_cells - index_sum  # alto é mau
         return 1/water_cells + index_sum + empty_cells * 1/heu + 1/filled + 1/remaining_boats
 
-def get_steps():
-    board = Board.parse_instance()
-    problem = Bimaru(board)
-    depth_first_tree_search(problem)
+# Tamanho por omissão da tabela de transposição
+TRANSPOSITIONS = 100000
+
+# Procuras que expandem cada estado no máximo uma vez e que, por isso, usam
+# por omissão a tabela de transposição do problema; as que voltam a expandir
+# os mesmos estados (aprofundamento iterativo, RBFS, IDA*) ficariam sem
+# sucessores. IDA* tem a sua própria tabela (ver ida_star_search)
+TRANSPOSITION_SOLVERS = ("dfs", "parallel_dfs")
+
+# Procuras disponíveis para resolver o problema
+SOLVERS = {
+    "dfs": depth_first_tree_search,
+    "exact_cover": exact_cover_search,
+    "sat": sat_search,
+    "parallel_dfs": parallel_depth_first_search,
+    "ida_star": ida_star_search,
+}
+
+def make_problem(engine: str = "bitboard", propagate: bool = False,
+                 transpositions: int = 0,
+                 symmetry_breaking: bool = False,
+                 branching: str = "largest", instance: tuple = None,
+                 trace="full") -> Bimaru:
+    """Cria o problema da instância 'instance' (devolvida por read_instance;
+    por omissão, a do ficheiro input.txt) com o motor 'engine'. A propagação
+    de restrições ('propagate', só com o motor bitboard) e a quebra de
+    simetria, que podem mudar a solução encontrada quando há várias, e a
+    tabela de transposição ('transpositions') só são usadas se pedidas.
+    'trace' é o registo dos passos da procura (ver Bimaru)."""
+    if instance is None:
+        board = ENGINES[engine].parse_instance()
+    else:
+        board = ENGINES[engine].from_instance(instance)
+    return Bimaru(board, propagate, transpositions, symmetry_breaking,
+                  branching, trace)
+
+def solve(problem: Bimaru, solver: str = "dfs", sat_binary: str = None,
+          workers: int = None, budget: SearchBudget = None,
+          transpositions: int = 0):
+    """Resolve o problema com a procura 'solver' e devolve o nó objetivo.
+    Com o solver "sat", 'sat_binary' é um resolvedor SAT local a usar em
+    vez do resolvedor embutido. Com o solver "parallel_dfs", 'workers' é o
+    número de processos (por omissão, um por CPU). Com o solver "ida_star",
+    'transpositions' é o tamanho da tabela de transposição da procura. Com
+    'budget', a procura desiste (e devolve None) quando se esgotam os nós ou
+    o tempo do orçamento ou quando é cancelada; budget.status diz porquê."""
+    if solver == "sat":
+        return sat_search(problem, sat_binary, budget)
+    if solver == "parallel_dfs":
+        return parallel_depth_first_search(problem, workers, budget=budget)
+    if solver == "ida_star":
+        return ida_star_search(problem, transpositions=transpositions, budget=budget)
+    return SOLVERS[solver](problem, budget=budget)
+
+def transposition_tables(transpositions: int, solver: str) -> tuple:
+    """Tamanhos das tabelas de transposição do problema (ver Bimaru) e da
+    procura (ver solve) a usar com a procura 'solver'. 'transpositions' é
+    o tamanho pedido (por omissão, TRANSPOSITIONS); vai para a tabela da
+    procura com "ida_star" e para a do problema com as procuras de
+    TRANSPOSITION_SOLVERS. As outras procuras não usam nenhuma."""
+    if solver == "ida_star":
+        return 0, TRANSPOSITIONS if transpositions is None else transpositions
+    if transpositions is None:
+        transpositions = TRANSPOSITIONS if solver in TRANSPOSITION_SOLVERS else 0
+    return transpositions, 0
+
+def get_steps(engine: str = "bitboard", propagate: bool = False,
+              transpositions: int = None,
+              symmetry_breaking: bool = False, branching: str = "largest",
+              solver: str = "dfs", sat_binary: str = None,
+              instance: tuple = None):
+    problem_table, search_table = transposition_tables(transpositions, solver)
+    problem = make_problem(engine, propagate, problem_table, symmetry_breaking,
+                           branching, instance)
+    solve(problem, solver, sat_binary, transpositions=search_table)
     return  problem.steps
 
-def get_limits():
-    board = Board.parse_instance()
+# Passos devolvidos por solve_instance: "full", todos os tabuleiros gerados;
+# "path", só os do caminho até à solução; "none", nenhum
+TRACE_MODES = ("full", "path", "none")
+
+def solve_instance(instance: tuple, mode: str = "full", wrap=None,
+                   budget: SearchBudget = None):
+    """Resolve a instância (devolvida por read_instance) e devolve os
+    limites, os passos da procura escolhidos por 'mode' (ver
+    DeltaTrace.to_json; None com "none") e o nó objetivo. 'wrap', se dado,
+    recebe o registo dos passos e devolve o registo que a procura usa, por
+    exemplo para acompanhar o seu progresso; 'budget' limita a procura
+    (ver solve)."""
+    if mode not in TRACE_MODES:
+        raise ValueError(f"Unknown trace mode: {mode}")
+    traces = []
+
+    def make_trace(board):
+        trace = TRACES["delta" if mode == "full" else "none"](board)
+        traces.append(trace)
+        return trace if wrap is None else wrap(trace)
+
+    problem = make_problem(instance=instance, transpositions=TRANSPOSITIONS,
+                           trace=make_trace)
+    goal_node = solve(problem, budget=budget)
+    board = problem.initial.board
+    limits = [board.limit_rows, board.limit_columns]
+    if mode == "full":
+        steps = traces[0].to_json()
+    elif mode == "path":
+        path = DeltaTrace.from_path(goal_node.path()) if goal_node else DeltaTrace(board)
+        steps = path.to_json()
+    else:
+        steps = None
+    return limits, steps, goal_node
+
+def solve_batch(instances, engine: str = "bitboard", propagate: bool = False,
+                transpositions: int = None,
+                symmetry_breaking: bool = False, branching: str = "largest",
+                solver: str = "dfs", sat_binary: str = None,
+                max_nodes: int = None, max_seconds: float = None):
+    """Resolve, uma a uma, as instâncias dos pares (nome, fonte) de
+    'instances' (a fonte é o que read_instance aceita) e gera, para cada
+    uma, um dicionário com o nome, o estado ("solved", "failed" se não tem
+    solução ou, se a procura desistiu, "node_limit" ou "time_limit"), a
+    solução (as linhas do tabuleiro, ou None), o número de nós expandidos
+    ("nodes", os que 'max_nodes' limita) e gerados ("generated") e o tempo
+    gasto. Cada procura expande no máximo 'max_nodes' nós e dura no
+    máximo 'max_seconds' segundos. As tabelas que só dependem do tamanho
+    do tabuleiro são calculadas uma vez para todas."""
+    problem_table, search_table = transposition_tables(transpositions, solver)
+    for name, source in instances:
+        start = time.perf_counter()
+        try:
+            instance = read_instance(source)
+            problem = make_problem(engine, propagate, problem_table,
+                                   symmetry_breaking, branching, instance,
+                                   trace="none")
+            budget = SearchBudget(max_nodes, max_seconds)
+            goal_node = solve(problem, solver, sat_binary, budget=budget,
+                              transpositions=search_table)
+        except ValueError as error:
+            result = {"name": name, "error": str(error)}
+        except Exception as error:
+            # um erro numa instância não interrompe as restantes
+            result = {"name": name,
+                      "error": "{}: {}".format(type(error).__name__, error)}
+        else:
+            result = {"name": name,
+                      "status": "solved" if goal_node else budget.status or "failed",
+                      "solution": str(goal_node.state.board).split("\n")
+                      if goal_node else None,
+                      "nodes": budget.nodes,
+                      "generated": len(problem.steps)}
+        result["seconds"] = round(time.perf_counter() - start, 6)
+        yield result
+
+def read_batch(directory: str):
+    """Gera os pares (nome, texto) das instâncias de uma diretoria."""
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                yield name, f.read()
+
+def get_limits(engine: str = "bitboard", instance: tuple = None):
+    if instance is None:
+        board = ENGINES[engine].parse_instance()
+    else:
+        board = ENGINES[engine].from_instance(instance)
     return [board.limit_rows, board.limit_columns]
 
 if __name__ == "__main__":
-    # Ler o ficheiro do standard input
-    board = Board.parse_instance()
-    # Usar uma técnica de procura para resolver a instância e obter o nó solução
-    problem = Bimaru(board)
-    goal_node = depth_first_tree_search(problem)
-    # Imprimir para o standard output no formato indicado
-    if goal_node:
-        print(goal_node.state.board)
+    parser = argparse.ArgumentParser(description="Resolve uma instância de Bimaru.")
+    parser.add_argument("--engine", choices=ENGINES.keys(), default="bitboard",
+                        help="representação do tabuleiro usada na procura")
+    parser.add_argument("--propagate", action=argparse.BooleanOptionalAction,
+                        default=False,
+                        help="propagar restrições antes e durante a procura "
+                             "(requer o motor bitboard; pode mudar a solução "
+                             "encontrada quando há várias)")
+    parser.add_argument("--transpositions", type=int,
+                        help="tamanho da tabela de transposição (0 desliga; "
+                             "por omissão, {} com as procuras {} e ida_star e "
+                             "0 com as outras)".format(
+                                 TRANSPOSITIONS, ", ".join(TRANSPOSITION_SOLVERS)))
+    parser.add_argument("--symmetry-breaking", action="store_true",
+                        help="colocar barcos do mesmo tamanho por ordem (pode "
+                             "mudar a solução encontrada quando há várias)")
+    parser.add_argument("--branching", choices=BRANCHING.keys(), default="largest",
+                        help="política de ramificação da procura")
+    parser.add_argument("--solver", choices=SOLVERS.keys(), default="dfs",
+                        help="procura usada (exact_cover e sat só registam nos "
+                             "passos o caminho da solução; parallel_dfs regista "
+                             "também a divisão da árvore)")
+    parser.add_argument("--sat-binary",
+                        help="resolvedor SAT local a usar com --solver sat "
+                             "(por omissão, o resolvedor embutido)")
+    parser.add_argument("--batch", metavar="DIR",
+                        help="resolver todas as instâncias da diretoria e "
+                             "escrever um resultado JSON por linha")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processos usados com --batch (por omissão um; "
+                             "com mais, os resultados saem pela ordem em que "
+                             "acabam) ou com --solver parallel_dfs (por "
+                             "omissão, um por CPU)")
+    parser.add_argument("--max-nodes", type=int,
+                        help="desistir de uma instância depois de expandir "
+                             "este número de nós")
+    parser.add_argument("--max-seconds", type=float,
+                        help="desistir de uma instância depois deste tempo")
+    args = parser.parse_args()
+    if args.batch:
+        options = dict(engine=args.engine, propagate=args.propagate,
+                       transpositions=args.transpositions,
+                       symmetry_breaking=args.symmetry_breaking,
+                       branching=args.branching, solver=args.solver,
+                       sat_binary=args.sat_binary, max_nodes=args.max_nodes,
+                       max_seconds=args.max_seconds)
+        if args.workers and args.workers > 1:
+            from pool import SolverPool
+            with SolverPool(args.workers) as pool:
+                for result in pool.solve_batch(read_batch(args.batch), **options):
+                    print(json.dumps(result), flush=True)
+        else:
+            for result in solve_batch(read_batch(args.batch), **options):
+                print(json.dumps(result), flush=True)
     else:
-        print("No solution found.")
+        # Ler o ficheiro do standard input
+        problem_table, search_table = transposition_tables(args.transpositions,
+                                                           args.solver)
+        problem = make_problem(args.engine, args.propagate, problem_table,
+                               args.symmetry_breaking, args.branching,
+                               trace="none")
+        # Usar uma técnica de procura para resolver a instância e obter o nó solução
+        budget = SearchBudget(args.max_nodes, args.max_seconds)
+        goal_node = solve(problem, args.solver, args.sat_binary, args.workers, budget,
+                          search_table)
+        # Imprimir para o standard output no formato indicado
+        if goal_node:
+            print(goal_node.state.board)
+        elif budget.status is not None:
+            print("Search stopped ({}).".format(budget.status))
+        else:
+            print("No solution found.")
@@ -0,0 +1,180 @@
+"""
+Solution cache
+
+Solved instances are stored under a canonical hash of their row and column
+limits, hints and fleet. There is an in-memory LRU tier and an optional
+on-disk tier (one file per instance, shared between processes), each bounded
+in bytes. Concurrent requests for an instance that is being solved wait for
+that solve instead of starting their own.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import Future
+
+
+def instance_key(rows, columns, hints, fleet):
+    """Canonical hash of an instance: the order of the hints and of the fleet
+    does not matter, and neither does the formatting of the instance file."""
+    canonical = {
+        "rows": [int(limit) for limit in rows],
+        "columns": [int(limit) for limit in columns],
+        "hints": sorted([int(row), int(col), str(value)] for row, col, value in hints),
+        "fleet": sorted((int(length) for length in fleet), reverse=True),
+    }
+    text = json.dumps(canonical, separators=(",", ":"), sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class SolutionCache:
+    """Serialized solutions (bytes) by instance key. The memory tier keeps at
+    most max_bytes, evicting the least recently used entries; if a directory
+    is given, entries are also written there and the oldest files are removed
+    once they take more than max_disk_bytes."""
+
+    def __init__(self, max_bytes=64 << 20, directory=None, max_disk_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.disk_lock = threading.Lock()
+        self.hits = self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.disk_size = sum(size for _, _, size in self.disk_entries())
+
+    def get(self, key):
+        """Return the solution stored for key, or None."""
+        with self.lock:
+            value = self.lookup(key)
+        if value is None:
+            value = self.read(key)
+            if value is not None:
+                with self.lock:
+                    self.remember(key, value)
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.remember(key, value)
+        self.write(key, value)
+
+    def get_or_compute(self, key, compute):
+        """Return the solution for key, calling compute() to produce it if no
+        tier has it. Only one caller computes a given key at a time; the
+        others wait for its result (or its exception)."""
+        with self.lock:
+            value = self.lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            value = self.read(key)
+            hit = value is not None
+            if not hit:
+                value = compute()
+                self.write(key, value)
+            with self.lock:
+                self.remember(key, value)
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            future.set_result(value)
+            return value
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Memory tier (callers hold self.lock)
+
+    def lookup(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def remember(self, key, value):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    # Disk tier
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def read(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key), "rb") as f:
+                value = f.read()
+            # the modification time orders the files for eviction
+            os.utime(self.path(key))
+        except OSError:
+            return None
+        return value
+
+    def write(self, key, value):
+        if self.directory is None or len(value) > self.max_disk_bytes:
+            return
+        # write to a temporary file first so that readers never see half a file
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.replace(temporary, self.path(key))
+        with self.disk_lock:
+            self.disk_size += len(value)
+            if self.disk_size > self.max_disk_bytes:
+                self.evict_disk()
+
+    def disk_entries(self):
+        """(modification time, path, size) of every file of the disk tier."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def evict_disk(self):
+        # other processes may share the directory, so recount from the files
+        entries = sorted(self.disk_entries())
+        self.disk_size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.disk_size <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.disk_size -= size
@@ -0,0 +1,303 @@
+"""
+Solve jobs
+
+Long solves run as jobs so that no web request waits for them. A job is
+stored in a local SQLite database, which is also the queue: a dispatcher
+thread hands queued jobs, oldest first, to a runner (a worker of the solver
+pool). While the search runs, the worker publishes its progress (nodes
+expanded so far, which the node budget limits) to the database and polls
+it for cancellation. Each job may have a node budget and a time budget (see
+search.SearchBudget); a search that runs out of either is stopped.
+
+Several dispatchers (one per server process) may share a database. Each owns
+the jobs it claimed and renews a lease on them every few seconds; only jobs
+whose owner stopped renewing, because its process died, are recovered by the
+others.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import bimaru
+from search import SearchBudget
+
+# queued: waiting for a worker; running; done: solved (the solution may be
+# None if the instance has none); stopped: a budget ran out (the error says
+# which, "node_limit" or "time_limit"); cancelled;
+# failed: the search raised an error
+STATUSES = ("queued", "running", "done", "stopped", "cancelled", "failed")
+
+# Seconds after which the jobs of a dispatcher that stopped renewing their
+# lease are recovered
+LEASE = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    dispatched INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease REAL,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    instance TEXT NOT NULL,
+    trace TEXT NOT NULL,
+    max_nodes INTEGER,
+    max_seconds REAL,
+    nodes INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+)
+"""
+
+
+class JobStore:
+    """The jobs of one SQLite database. Every method opens its own
+    connection, so a store can be shared by threads and processes."""
+
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(SCHEMA)
+            # databases created before jobs had owners
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            for column in ("owner TEXT", "lease REAL"):
+                if column.split()[0] not in columns:
+                    db.execute("ALTER TABLE jobs ADD COLUMN " + column)
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def execute(self, query, *args):
+        """Run a statement in its own transaction; return the rows changed."""
+        db = self.connect()
+        try:
+            with db:
+                return db.execute(query, args).rowcount
+        finally:
+            db.close()
+
+    def fetch(self, query, *args):
+        """Return the first row of a query, or None."""
+        db = self.connect()
+        try:
+            return db.execute(query, args).fetchone()
+        finally:
+            db.close()
+
+    def create(self, instance, trace="full", max_nodes=None, max_seconds=None):
+        """Queue a job for the instance (as returned by bimaru.read_instance)
+        and return its id."""
+        job_id = uuid.uuid4().hex
+        self.execute("INSERT INTO jobs (id, status, instance, trace, max_nodes, "
+                     "max_seconds, created) VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                     job_id, json.dumps(instance), trace, max_nodes, max_seconds,
+                     time.time())
+        return job_id
+
+    def get(self, job_id):
+        """Return the job as a dict (without its result), or None."""
+        row = self.fetch("SELECT * FROM jobs WHERE id = ?", job_id)
+        if row is None:
+            return None
+        job = dict(row)
+        del job["result"], job["dispatched"], job["owner"], job["lease"]
+        job["instance"] = json.loads(job["instance"])
+        job["cancel"] = bool(job["cancel"])
+        end = job["finished"] or time.time()
+        job["seconds"] = round(end - job["started"], 6) if job["started"] else 0
+        return job
+
+    def result(self, job_id):
+        """Return the serialized result of a finished job, or None."""
+        row = self.fetch("SELECT result FROM jobs WHERE id = ?", job_id)
+        return row["result"] if row is not None else None
+
+    def cancel(self, job_id):
+        """Ask for the job to be cancelled. A queued job is cancelled at
+        once; a running one when its worker next polls. Return False if the
+        job does not exist."""
+        found = self.execute("UPDATE jobs SET cancel = 1 WHERE id = ?", job_id)
+        self.execute("UPDATE jobs SET status = 'cancelled', finished = ? "
+                     "WHERE id = ? AND status = 'queued'", time.time(), job_id)
+        return found > 0
+
+    def claim(self, owner):
+        """Mark the oldest queued job not yet handed to a runner as handed
+        by `owner` and return its id, or None."""
+        while True:
+            row = self.fetch("SELECT id FROM jobs WHERE status = 'queued' AND "
+                               "dispatched = 0 ORDER BY created LIMIT 1")
+            if row is None:
+                return None
+            # another dispatcher may have claimed it first
+            if self.execute("UPDATE jobs SET dispatched = 1, owner = ?, lease = ? "
+                            "WHERE id = ? AND dispatched = 0", owner, time.time(),
+                            row["id"]):
+                return row["id"]
+
+    def renew(self, owner):
+        """Renew the lease of the unfinished jobs of `owner`."""
+        self.execute("UPDATE jobs SET lease = ? WHERE owner = ? AND status IN "
+                     "('queued', 'running')", time.time(), owner)
+
+    def recover(self, lease=LEASE):
+        """Recover the jobs whose lease was not renewed for `lease` seconds
+        (their owner died): queue again the ones that were handed to a
+        runner but had not started, and fail the ones that were running."""
+        expired = time.time() - lease
+        self.execute("UPDATE jobs SET dispatched = 0, owner = NULL WHERE "
+                     "status = 'queued' AND dispatched = 1 AND lease < ?", expired)
+        self.execute("UPDATE jobs SET status = 'failed', error = 'interrupted', "
+                     "finished = ? WHERE status = 'running' AND lease < ?",
+                     time.time(), expired)
+
+    def start(self, job_id):
+        """Mark the job as running; return False if it was cancelled."""
+        return self.execute("UPDATE jobs SET status = 'running', started = ? "
+                            "WHERE id = ? AND status = 'queued'", time.time(), job_id) > 0
+
+    def progress(self, job_id, nodes):
+        """Publish the nodes expanded so far; return True if the job has
+        been cancelled."""
+        self.execute("UPDATE jobs SET nodes = ? WHERE id = ?", nodes, job_id)
+        row = self.fetch("SELECT cancel FROM jobs WHERE id = ?", job_id)
+        return bool(row["cancel"])
+
+    def fail(self, job_id, error):
+        """Fail a job that is queued or running, for example because its
+        runner died before it could finish it."""
+        self.execute("UPDATE jobs SET status = 'failed', error = ?, finished = ? "
+                     "WHERE id = ? AND status IN ('queued', 'running')", error,
+                     time.time(), job_id)
+
+    def finish(self, job_id, status, nodes, result=None, error=None):
+        """Store the outcome of a running job (unless it was recovered as
+        failed in the meantime)."""
+        self.execute("UPDATE jobs SET status = ?, nodes = ?, result = ?, error = ?, "
+                     "finished = ? WHERE id = ? AND status = 'running'", status,
+                     nodes, result, error, time.time(), job_id)
+
+
+class JobTrace:
+    """Wraps the trace of a job's search (see bimaru.Bimaru). It counts the
+    nodes generated and, every `interval` seconds, publishes the nodes
+    expanded so far (counted by the search's budget) and checks for
+    cancellation, setting the budget's cancellation token if the job was
+    cancelled."""
+
+    def __init__(self, trace, store, job_id, budget, interval=0.5):
+        self.trace = trace
+        self.store = store
+        self.job_id = job_id
+        self.budget = budget
+        self.interval = interval
+        self.next_poll = time.monotonic() + interval
+        self.nodes = 0
+
+    def record(self, board, parent):
+        self.nodes += 1
+        now = time.monotonic()
+        if now > self.next_poll:
+            self.next_poll = now + self.interval
+            if self.store.progress(self.job_id, self.budget.nodes):
+                self.budget.cancel.set()
+        return self.trace.record(board, parent)
+
+    def __len__(self):
+        return self.nodes
+
+
+def run_job(path, job_id):
+    """Solve a queued job of the database at `path` (in a worker process
+    or a thread) and store its result: the limits, the solution and the
+    steps of its trace mode, as POST /solve returns them."""
+    store = JobStore(path)
+    if not store.start(job_id):
+        return
+    job = store.get(job_id)
+    budget = SearchBudget(job["max_nodes"], job["max_seconds"], threading.Event())
+
+    def wrap(trace):
+        return JobTrace(trace, store, job_id, budget)
+
+    rows, columns, hints, fleet = job["instance"]
+    instance = rows, columns, [tuple(hint) for hint in hints], fleet
+    try:
+        limits, steps, goal_node = bimaru.solve_instance(instance, job["trace"],
+                                                         wrap, budget)
+    except Exception as error:
+        store.finish(job_id, "failed", budget.nodes, error=str(error))
+        return
+    if goal_node is None and budget.status is not None:
+        status = "cancelled" if budget.status == "cancelled" else "stopped"
+        store.finish(job_id, status, budget.nodes, error=budget.status)
+        return
+    solution = str(goal_node.state.board).split("\n") if goal_node else None
+    result = json.dumps({"limits": limits, "solution": solution, "steps": steps},
+                        separators=(",", ":"))
+    store.finish(job_id, "done", budget.nodes, result=result)
+
+
+class Dispatcher:
+    """A daemon thread that hands the queued jobs of a store to `submit`,
+    called as submit(run_job, path, job_id) (for example SolverPool.submit,
+    which blocks while the pool is busy, so jobs wait in the database
+    rather than in memory). If submit returns a future, the job is failed
+    when the future ends with an error (its worker died); a job that submit
+    itself raised on is failed too. notify() wakes it up when a job is
+    queued.
+    A second thread renews the lease of the jobs it claimed and recovers
+    the expired jobs of dead dispatchers."""
+
+    def __init__(self, store, submit, poll=1.0, lease=LEASE):
+        self.store = store
+        self.submit = submit
+        self.poll = poll
+        self.lease = lease
+        self.owner = "{}-{}".format(os.getpid(), uuid.uuid4().hex)
+        self.wake = threading.Event()
+        threading.Thread(target=self.keep_alive, daemon=True).start()
+        threading.Thread(target=self.loop, daemon=True).start()
+
+    def notify(self):
+        self.wake.set()
+
+    def keep_alive(self):
+        while True:
+            self.store.renew(self.owner)
+            self.store.recover(self.lease)
+            time.sleep(self.lease / 3)
+
+    def loop(self):
+        while True:
+            job_id = self.store.claim(self.owner)
+            if job_id is None:
+                # jobs may also be queued by other processes
+                self.wake.wait(self.poll)
+                self.wake.clear()
+                continue
+            try:
+                future = self.submit(run_job, self.store.path, job_id)
+            except Exception as error:
+                self.store.fail(job_id, "{}: {}".format(type(error).__name__, error))
+                continue
+            if future is not None:
+                future.add_done_callback(
+                    lambda future, job_id=job_id: self.done(job_id, future))
+
+    def done(self, job_id, future):
+        if future.cancelled():
+            self.store.fail(job_id, "cancelled by the pool")
+        elif future.exception() is not None:
+            error = future.exception()
+            self.store.fail(job_id, "{}: {}".format(type(error).__name__, error))
@@ -0,0 +1,102 @@
+"""
+Solver pool
+
+Solves independent instances in parallel on a ProcessPoolExecutor of warm
+worker processes. Each worker imports the solver once and keeps its caches
+(board geometry, boat masks, Zobrist keys) from one task to the next. At
+most max_pending tasks are queued or running at any time; submit blocks
+while that many are outstanding, so a fast producer cannot pile up work.
+If a worker dies (killed, or out of memory), the tasks it had fail with
+BrokenProcessPool and the next submit replaces the broken executor.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bimaru
+
+
+def warm_up():
+    """Worker initializer: build the tables of the classic 10x10 board."""
+    bimaru.geometry(10)
+
+
+def solve_one(name, source, options):
+    """Solve one instance in a worker; see bimaru.solve_batch."""
+    return next(bimaru.solve_batch([(name, source)], **options))
+
+
+def batch_result(name, future):
+    """The result of a solve_one future, or an error result for the
+    instance if its worker failed (for example, if it died)."""
+    try:
+        return future.result()
+    except Exception as error:
+        return {"name": name, "error": "{}: {}".format(type(error).__name__, error)}
+
+
+class SolverPool:
+    """A pool of `workers` solver processes (by default one per CPU) with at
+    most `max_pending` outstanding tasks (by default two per worker)."""
+
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = workers or os.cpu_count()
+        self.executor = ProcessPoolExecutor(self.workers, initializer=warm_up)
+        self.slots = threading.BoundedSemaphore(max_pending or 2 * self.workers)
+        self.lock = threading.Lock()
+
+    def submit(self, function, *args):
+        """Run function(*args) in a worker, waiting for a free slot first.
+        The function and its arguments must be picklable."""
+        self.slots.acquire()
+        try:
+            executor = self.executor
+            try:
+                future = executor.submit(function, *args)
+            except BrokenProcessPool:
+                future = self.restart(executor).submit(function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def restart(self, broken):
+        """Replace the executor `broken`, one of whose workers died, unless
+        another thread already did; return the current executor."""
+        with self.lock:
+            if self.executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self.executor = ProcessPoolExecutor(self.workers, initializer=warm_up)
+            return self.executor
+
+    def run(self, function, *args):
+        """Run function(*args) in a worker and return its result."""
+        return self.submit(function, *args).result()
+
+    def solve_batch(self, instances, **options):
+        """Like bimaru.solve_batch, but the instances are solved in parallel
+        and the results are generated in the order they finish."""
+        finished = queue.Queue()
+        outstanding = 0
+        for name, source in instances:
+            future = self.submit(solve_one, name, source, options)
+            future.add_done_callback(lambda future, name=name: finished.put((name, future)))
+            outstanding += 1
+            while not finished.empty():
+                outstanding -= 1
+                yield batch_result(*finished.get())
+        for _ in range(outstanding):
+            yield batch_result(*finished.get())
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
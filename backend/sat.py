@@ -0,0 +1,347 @@
+"""
+Propositional satisfiability
+
+A small CNF builder with cardinality constraints, an embedded CDCL solver
+(two watched literals, first-UIP clause learning, VSIDS-like branching,
+phase saving and Luby restarts) and a wrapper around any local solver
+binary that reads DIMACS and prints its model in the SAT competition format
+(kissat, cadical, glucose -model, ...).
+"""
+
+import heapq
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+class CNF:
+    """A formula in conjunctive normal form. Variables are positive integers
+    and literals are non-zero integers, negative for negated variables."""
+
+    def __init__(self):
+        self.num_vars = 0
+        self.clauses = []
+        # literals the solver should try first, with that polarity
+        self.preferred = []
+
+    def new_var(self):
+        self.num_vars += 1
+        return self.num_vars
+
+    def add(self, clause):
+        self.clauses.append(list(clause))
+
+    def prefer(self, literal):
+        """Hint that the solver should decide the literal early, as true."""
+        self.preferred.append(literal)
+
+    def counter(self, literals, k):
+        """Sequential counter: return the variables r[j] (j < k) that are
+        true if and only if at least j + 1 of the literals are true."""
+        previous = []
+        for literal in literals:
+            current = [self.new_var() for _ in range(min(len(previous) + 1, k))]
+            for j, r in enumerate(current):
+                below = previous[j - 1] if j else None
+                same = previous[j] if j < len(previous) else None
+                # r is true if the count was already j + 1 or if the
+                # literal is true and the count was j
+                if same is not None:
+                    self.add([-same, r])
+                self.add([-literal, r] if below is None else [-literal, -below, r])
+                self.add([-r, literal] if same is None else [-r, same, literal])
+                if below is not None:
+                    self.add([-r, below] if same is None else [-r, same, below])
+            previous = current
+        return previous
+
+    def at_most(self, literals, k):
+        """At most k of the literals are true."""
+        literals = list(literals)
+        if k < 0:
+            self.add([])
+        elif k < len(literals):
+            counts = self.counter(literals, k + 1)
+            self.add([-counts[k]])
+
+    def at_least(self, literals, k):
+        """At least k of the literals are true."""
+        literals = list(literals)
+        if k > len(literals):
+            self.add([])
+        elif k > 0:
+            self.add([self.counter(literals, k)[k - 1]])
+
+    def exactly(self, literals, k):
+        """Exactly k of the literals are true."""
+        literals = list(literals)
+        if k < 0 or k > len(literals):
+            self.add([])
+        elif k == len(literals):
+            for literal in literals:
+                self.add([literal])
+        else:
+            counts = self.counter(literals, k + 1)
+            self.add([-counts[k]])
+            if k > 0:
+                self.add([counts[k - 1]])
+
+    def dimacs(self):
+        lines = ["p cnf {} {}".format(self.num_vars, len(self.clauses))]
+        lines.extend(" ".join(map(str, clause + [0])) for clause in self.clauses)
+        return "\n".join(lines) + "\n"
+
+
+def luby(i):
+    """The i-th term (from 1) of the Luby sequence 1 1 2 1 1 2 4 ..."""
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    while (1 << k) - 1 != i:
+        i -= (1 << (k - 1)) - 1
+        k = 1
+        while (1 << k) - 1 < i:
+            k += 1
+    return 1 << (k - 1)
+
+
+class CDCLSolver:
+    """Conflict-driven clause learning solver for a CNF."""
+
+    restart_base = 100
+    decay = 0.95
+
+    def __init__(self, cnf):
+        n = cnf.num_vars
+        self.num_vars = n
+        # indexed by literal (negative literals index from the end):
+        # 1 true, -1 false, 0 unassigned
+        self.values = [0] * (2 * n + 1)
+        self.level = [0] * (n + 1)
+        self.reason = [None] * (n + 1)
+        self.phase = [-1] * (n + 1)
+        self.activity = [0.0] * (n + 1)
+        self.increment = 1.0
+        for literal in cnf.preferred:
+            self.activity[abs(literal)] = 1.0
+            self.phase[abs(literal)] = 1 if literal > 0 else -1
+        self.heap = [(-self.activity[v], v) for v in range(1, n + 1)]
+        heapq.heapify(self.heap)
+        self.trail = []
+        self.trail_limits = []
+        self.head = 0
+        self.clauses = []
+        self.watches = [[] for _ in range(2 * n + 1)]
+        self.conflicts = 0
+        self.inconsistent = False
+        for clause in cnf.clauses:
+            clause = list(dict.fromkeys(clause))
+            if any(-literal in clause for literal in clause):
+                continue
+            if not clause:
+                self.inconsistent = True
+            elif len(clause) == 1:
+                if not self.assign(clause[0], None):
+                    self.inconsistent = True
+            else:
+                self.attach(clause)
+
+    def attach(self, clause):
+        index = len(self.clauses)
+        self.clauses.append(clause)
+        self.watches[clause[0]].append(index)
+        self.watches[clause[1]].append(index)
+        return index
+
+    def assign(self, literal, reason):
+        """Make the literal true; return False if it is already false."""
+        value = self.values[literal]
+        if value:
+            return value == 1
+        var = abs(literal)
+        self.values[literal] = 1
+        self.values[-literal] = -1
+        self.level[var] = len(self.trail_limits)
+        self.reason[var] = reason
+        self.trail.append(literal)
+        return True
+
+    def propagate(self):
+        """Unit propagation; return the index of a conflicting clause."""
+        values, clauses, watches, trail = \
+            self.values, self.clauses, self.watches, self.trail
+        while self.head < len(trail):
+            false_literal = -trail[self.head]
+            self.head += 1
+            watching = watches[false_literal]
+            kept = []
+            i = 0
+            while i < len(watching):
+                index = watching[i]
+                i += 1
+                clause = clauses[index]
+                if clause[0] == false_literal:
+                    clause[0], clause[1] = clause[1], clause[0]
+                first = clause[0]
+                if values[first] == 1:
+                    kept.append(index)
+                    continue
+                for k in range(2, len(clause)):
+                    if values[clause[k]] != -1:
+                        clause[1], clause[k] = clause[k], clause[1]
+                        watches[clause[1]].append(index)
+                        break
+                else:
+                    kept.append(index)
+                    if values[first] == -1:
+                        kept.extend(watching[i:])
+                        watches[false_literal] = kept
+                        return index
+                    self.assign(first, index)
+            watches[false_literal] = kept
+        return None
+
+    def bump(self, var):
+        self.activity[var] += self.increment
+        if self.activity[var] > 1e100:
+            self.activity = [activity * 1e-100 for activity in self.activity]
+            self.increment *= 1e-100
+            self.heap = [(-self.activity[v], v) for v in range(1, self.num_vars + 1)
+                         if not self.values[v]]
+            heapq.heapify(self.heap)
+        elif not self.values[var]:
+            heapq.heappush(self.heap, (-self.activity[var], var))
+
+    def analyze(self, conflict):
+        """First-UIP learning; return the learnt clause and backjump level."""
+        seen = set()
+        learnt = [None]
+        current = len(self.trail_limits)
+        pending = 0
+        literal = None
+        index = len(self.trail) - 1
+        clause = self.clauses[conflict]
+        while True:
+            for q in clause:
+                var = abs(q)
+                if q == literal or var in seen or self.level[var] == 0:
+                    continue
+                seen.add(var)
+                self.bump(var)
+                if self.level[var] == current:
+                    pending += 1
+                else:
+                    learnt.append(q)
+            while abs(self.trail[index]) not in seen:
+                index -= 1
+            literal = self.trail[index]
+            index -= 1
+            pending -= 1
+            if not pending:
+                break
+            clause = self.clauses[self.reason[abs(literal)]]
+        learnt[0] = -literal
+        self.increment /= self.decay
+        if len(learnt) == 1:
+            return learnt, 0
+        # the literal of the highest remaining level is watched with the UIP
+        top = max(range(1, len(learnt)), key=lambda k: self.level[abs(learnt[k])])
+        learnt[1], learnt[top] = learnt[top], learnt[1]
+        return learnt, self.level[abs(learnt[1])]
+
+    def backtrack(self, level):
+        if len(self.trail_limits) <= level:
+            return
+        limit = self.trail_limits[level]
+        for literal in self.trail[limit:]:
+            var = abs(literal)
+            self.phase[var] = self.values[var]
+            self.values[var] = self.values[-var] = 0
+            self.reason[var] = None
+            heapq.heappush(self.heap, (-self.activity[var], var))
+        del self.trail[limit:]
+        del self.trail_limits[level:]
+        self.head = limit
+
+    def decide(self):
+        while self.heap:
+            _, var = heapq.heappop(self.heap)
+            if not self.values[var]:
+                self.trail_limits.append(len(self.trail))
+                self.assign(var if self.phase[var] == 1 else -var, None)
+                return True
+        return False
+
+    def solve(self, budget=None):
+        """Return the set of true variables of a model, or None. With a
+        budget (see search.SearchBudget), each decision counts as a node and
+        the solver gives up, returning None, once the budget runs out."""
+        if self.inconsistent or self.propagate() is not None:
+            return None
+        restarts = 1
+        until_restart = self.restart_base * luby(restarts)
+        while True:
+            conflict = self.propagate()
+            if conflict is not None:
+                self.conflicts += 1
+                if not self.trail_limits:
+                    return None
+                learnt, level = self.analyze(conflict)
+                self.backtrack(level)
+                if len(learnt) == 1:
+                    self.assign(learnt[0], None)
+                else:
+                    self.assign(learnt[0], self.attach(learnt))
+                until_restart -= 1
+            elif until_restart <= 0:
+                restarts += 1
+                until_restart = self.restart_base * luby(restarts)
+                self.backtrack(0)
+            elif budget is not None and not budget.visit():
+                return None
+            elif not self.decide():
+                return {v for v in range(1, self.num_vars + 1) if self.values[v] == 1}
+
+
+def run_binary(cnf, binary, timeout=None):
+    """Solve the CNF with a local solver binary. Return the set of true
+    variables of a model, or None if the formula is unsatisfiable. Raises
+    subprocess.TimeoutExpired if the binary runs for more than 'timeout'
+    seconds."""
+    path = shutil.which(binary)
+    if path is None:
+        raise ValueError("SAT solver not found: {}".format(binary))
+    with tempfile.NamedTemporaryFile("w", suffix=".cnf", delete=False) as f:
+        f.write(cnf.dimacs())
+    try:
+        output = subprocess.run([path, f.name], capture_output=True, text=True,
+                                timeout=timeout).stdout
+    finally:
+        os.unlink(f.name)
+    model = set()
+    status = None
+    for line in output.splitlines():
+        if line.startswith("s "):
+            status = line[2:].strip()
+        elif line.startswith("v "):
+            model.update(int(literal) for literal in line[2:].split() if int(literal) > 0)
+    if status == "SATISFIABLE":
+        return model
+    if status == "UNSATISFIABLE":
+        return None
+    raise ValueError("Unexpected output from {}".format(binary))
+
+
+def solve_cnf(cnf, binary=None, budget=None):
+    """Solve the CNF with the embedded solver or, if given, a local binary.
+    A budget limits the embedded solver as in CDCLSolver.solve and the
+    binary to the time it has left."""
+    if binary is not None:
+        timeout = None if budget is None else budget.remaining_seconds()
+        try:
+            return run_binary(cnf, binary, timeout)
+        except subprocess.TimeoutExpired:
+            budget.status = "time_limit"
+            return None
+    return CDCLSolver(cnf).solve(budget)
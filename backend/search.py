@@ -6,9 +6,16 @@ then create problem instances and solve them with calls to the various search
 functions.
 """
 
+import heapq
+import multiprocessing
+import os
 import sys
-from collections import deque
+import time
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
+from sat import solve_cnf
 from utils import *
 
 
@@ -73,7 +80,11 @@ class Node:
     the total path_cost (also known as g) to reach the node. Other functions
     may add an f and h value; see best_first_graph_search and astar_search for
     an explanation of how the f and h values are handled. You will not need to
-    subclass this class."""
+    subclass this class.
+    Nodes have slots instead of a __dict__, since searches create millions of
+    them; f and h have slots too, unset until a search stores them."""
+
+    __slots__ = ('state', 'parent', 'action', 'path_cost', 'depth', 'f', 'h')
 
     def __init__(self, state, parent=None, action=None, path_cost=0):
         """Create a search tree Node, derived from a parent by an action."""
@@ -130,6 +141,88 @@ class Node:
         return hash(self.state)
 
 
+class NodeArena:
+    """Compact storage of a search tree: for each expanded node, only the
+    index of its parent (in an array) and the action that reached it. The
+    nodes of the tree are ArenaNodes, which do not keep their parent alive,
+    so only the nodes still held by a search (its frontier) keep their
+    states; paths are rebuilt on demand by applying the actions again from
+    the initial state, which requires the problem's result() to be
+    deterministic."""
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.parents = array('l', [-1])
+        self.actions = [None]
+
+    def root(self):
+        root = ArenaNode(self.problem.initial, self, -1)
+        root.index = 0
+        return root
+
+    def add(self, parent, action):
+        """Store a child of node 'parent'; return its index."""
+        self.parents.append(parent)
+        self.actions.append(action)
+        return len(self.actions) - 1
+
+    def solution(self, index):
+        """The actions from the root to node 'index'."""
+        actions = []
+        while index > 0:
+            actions.append(self.actions[index])
+            index = self.parents[index]
+        return actions[::-1]
+
+    def __len__(self):
+        return len(self.actions)
+
+
+class ArenaNode(Node):
+    """A Node whose ancestors are stored in a NodeArena: it keeps the index of
+    its parent there instead of the parent itself (parent is None), and is
+    added to the arena only when it is expanded, so the children that are
+    generated but never expanded take no room in it. solution() reads the
+    actions from the arena and path() applies them again from the initial
+    state."""
+
+    __slots__ = ('arena', 'parent_index', 'index')
+
+    def __init__(self, state, arena, parent_index, action=None, path_cost=0, depth=0):
+        self.state = state
+        self.parent = None
+        self.action = action
+        self.path_cost = path_cost
+        self.depth = depth
+        self.arena = arena
+        self.parent_index = parent_index
+        self.index = None
+
+    def child_node(self, problem, action):
+        if self.index is None:
+            self.index = self.arena.add(self.parent_index, self.action)
+        next_state = problem.result(self.state, action)
+        return ArenaNode(next_state, self.arena, self.index, action,
+                         problem.path_cost(self.path_cost, self.state, action, next_state),
+                         self.depth + 1)
+
+    def solution(self):
+        if self.index is None:
+            return self.arena.solution(self.parent_index) + [self.action]
+        return self.arena.solution(self.index)
+
+    def path(self):
+        node = Node(self.arena.problem.initial)
+        for action in self.solution():
+            node = node.child_node(self.arena.problem, action)
+        return node.path()
+
+
+def root_node(problem, compact=False):
+    """The root of a search tree: a Node or, if compact, an ArenaNode."""
+    return NodeArena(problem).root() if compact else Node(problem.initial)
+
+
 # ______________________________________________________________________________
 
 
@@ -171,36 +264,126 @@ class SimpleProblemSolvingAgentProgram:
         raise NotImplementedError
 
 
+# ______________________________________________________________________________
+# Search budgets
+
+
+class SearchBudget:
+    """Limits of one search: at most max_nodes expanded nodes, at most
+    max_seconds of wall-clock time from the creation of the budget, and an
+    optional cancellation token (any object with an is_set() method, such as
+    a threading.Event). A search given a budget calls visit() for each node
+    it expands and gives up, returning None, once visit() returns False; the
+    budget then says why in status ("node_limit", "time_limit" or
+    "cancelled"). It also counts the nodes and keeps the best node expanded
+    so far: the one with the lowest score, by default the deepest."""
+
+    def __init__(self, max_nodes=None, max_seconds=None, cancel=None):
+        self.max_nodes = max_nodes
+        self.max_seconds = max_seconds
+        self.cancel = cancel
+        self.start = time.monotonic()
+        self.deadline = None if max_seconds is None else self.start + max_seconds
+        self.nodes = 0
+        self.best = None
+        self.best_score = None
+        self.status = None
+
+    def visit(self, node=None, score=None):
+        """Count an expanded node; return False if the search must stop."""
+        if not self.allows(1):
+            return False
+        self.nodes += 1
+        if node is not None:
+            if score is None:
+                score = -node.depth
+            if self.best is None or score <= self.best_score:
+                self.best, self.best_score = node, score
+        return True
+
+    def allows(self, nodes):
+        """Return False, and set the status, if expanding 'nodes' more nodes
+        would exceed the budget, the time is up or the search was
+        cancelled."""
+        if self.status is None:
+            if self.max_nodes is not None and self.nodes + nodes > self.max_nodes:
+                self.status = "node_limit"
+            elif self.deadline is not None and time.monotonic() >= self.deadline:
+                self.status = "time_limit"
+            elif self.cancel is not None and self.cancel.is_set():
+                self.status = "cancelled"
+        return self.status is None
+
+    def charge(self, nodes):
+        """Count nodes already expanded elsewhere (by worker processes);
+        return False if the search must stop."""
+        self.nodes += nodes
+        return self.allows(0)
+
+    def remaining_seconds(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+
+# The outcome of limited_search: status is "solved", "failed" (the search
+# space was exhausted), "cutoff" (depth_limited_search reached its limit)
+# or the status of the budget; node is the goal node (or None) and best the
+# best node expanded before the search stopped.
+SearchResult = namedtuple("SearchResult", "status node best nodes seconds")
+
+
+def limited_search(search, problem, max_nodes=None, max_seconds=None,
+                   cancel=None, **kwargs):
+    """Run search(problem, budget=..., **kwargs) within the given limits and
+    return a SearchResult."""
+    budget = SearchBudget(max_nodes, max_seconds, cancel)
+    node = search(problem, budget=budget, **kwargs)
+    if node == 'cutoff':
+        status, node = 'cutoff', None
+    elif node is not None:
+        status = "solved"
+    else:
+        status = budget.status or "failed"
+    return SearchResult(status, node, budget.best, budget.nodes, budget.elapsed())
+
+
 # ______________________________________________________________________________
 # Uninformed Search algorithms
 
 
-def breadth_first_tree_search(problem):
+def breadth_first_tree_search(problem, budget=None, compact=False):
     """
     [Figure 3.7]
     Search the shallowest nodes in the search tree first.
     Search through the successors of a problem to find a goal.
     The argument frontier should be an empty queue.
-    Repeats infinitely in case of loops.
+    Repeats infinitely in case of loops, unless given a SearchBudget.
+    If compact, the search tree is kept in a NodeArena.
     """
 
-    frontier = deque([Node(problem.initial)])  # FIFO queue
+    frontier = deque([root_node(problem, compact)])  # FIFO queue
 
     while frontier:
         node = frontier.popleft()
         if problem.goal_test(node.state):
             return node
+        if budget is not None and not budget.visit(node):
+            return None
         frontier.extend(node.expand(problem))
     return None
 
 
-def depth_first_tree_search(problem):
+def depth_first_tree_search(problem, budget=None):
     """
     [Figure 3.7]
     Search the deepest nodes in the search tree first.
     Search through the successors of a problem to find a goal.
     The argument frontier should be an empty queue.
-    Repeats infinitely in case of loops.
+    Repeats infinitely in case of loops, unless given a SearchBudget.
     """
 
     frontier = [Node(problem.initial)]  # Stack
@@ -209,11 +392,13 @@ def depth_first_tree_search(problem):
         node = frontier.pop()
         if problem.goal_test(node.state):
             return node
+        if budget is not None and not budget.visit(node):
+            return None
         frontier.extend(node.expand(problem))
     return None
 
 
-def depth_first_graph_search(problem):
+def depth_first_graph_search(problem, budget=None):
     """
     [Figure 3.7]
     Search the deepest nodes in the search tree first.
@@ -223,50 +408,64 @@ def depth_first_graph_search(problem):
     If two paths reach a state, only use the first one.
     """
     frontier = [(Node(problem.initial))]  # Stack
+    in_frontier = {problem.initial}  # the states of the frontier
 
     explored = set()
     while frontier:
         node = frontier.pop()
+        in_frontier.remove(node.state)
         if problem.goal_test(node.state):
             return node
+        if budget is not None and not budget.visit(node):
+            return None
         explored.add(node.state)
-        frontier.extend(child for child in node.expand(problem)
-                        if child.state not in explored and child not in frontier)
+        for child in node.expand(problem):
+            if child.state not in explored and child.state not in in_frontier:
+                frontier.append(child)
+                in_frontier.add(child.state)
     return None
 
 
-def breadth_first_graph_search(problem):
+def breadth_first_graph_search(problem, budget=None, compact=False):
     """[Figure 3.11]
     Note that this function can be implemented in a
     single line as below:
     return graph_search(problem, FIFOQueue())
+    If compact, the search tree is kept in a NodeArena.
     """
-    node = Node(problem.initial)
+    node = root_node(problem, compact)
     if problem.goal_test(node.state):
         return node
     frontier = deque([node])
+    in_frontier = {node.state}  # the states of the frontier
     explored = set()
     while frontier:
         node = frontier.popleft()
+        in_frontier.remove(node.state)
+        if budget is not None and not budget.visit(node):
+            return None
         explored.add(node.state)
         for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
+            if child.state not in explored and child.state not in in_frontier:
                 if problem.goal_test(child.state):
                     return child
                 frontier.append(child)
+                in_frontier.add(child.state)
     return None
 
 
-def best_first_graph_search(problem, f, display=False):
+def best_first_graph_search(problem, f, display=False, budget=None, compact=False):
     """Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
     first search; if f is node.depth then we have breadth-first search.
     There is a subtlety: the line "f = memoize(f, 'f')" means that the f
     values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
+    a best first search you can examine the f values of the path returned.
+    If compact, the search tree is kept in a NodeArena: the nodes that leave
+    the frontier are freed, and the path returned is rebuilt (without f)."""
     f = memoize(f, 'f')
-    node = Node(problem.initial)
+    node = root_node(problem, compact)
     frontier = PriorityQueue('min', f)
     frontier.append(node)
     explored = set()
@@ -276,6 +475,8 @@ def best_first_graph_search(problem, f, display=False):
             if display:
                 print(len(explored), "paths have been expanded and", len(frontier), "paths remain in the frontier")
             return node
+        if budget is not None and not budget.visit(node, f(node)):
+            return None
         explored.add(node.state)
         for child in node.expand(problem):
             if child.state not in explored and child not in frontier:
@@ -287,37 +488,56 @@ def best_first_graph_search(problem, f, display=False):
     return None
 
 
-def uniform_cost_search(problem, display=False):
+def uniform_cost_search(problem, display=False, budget=None, compact=False):
     """[Figure 3.14]"""
-    return best_first_graph_search(problem, lambda node: node.path_cost, display)
+    return best_first_graph_search(problem, lambda node: node.path_cost, display, budget,
+                                   compact)
 
 
-def depth_limited_search(problem, limit=50):
-    """[Figure 3.17]"""
+def depth_limited_search(problem, limit=50, budget=None):
+    """[Figure 3.17]
+    The recursion of the figure is replaced by an explicit stack, so the
+    limit is not bounded by Python's recursion limit."""
 
-    def recursive_dls(node, problem, limit):
+    # The nodes being expanded, innermost last, as [iterator over the children
+    # not yet searched, depth limit of the children, cutoff_occurred]
+    stack = []
+    node = Node(problem.initial)
+    while True:
+        # the budget ran out: the nodes left on the stack are not searched
+        if budget is not None and budget.status is not None:
+            return None
         if problem.goal_test(node.state):
             return node
         elif limit == 0:
-            return 'cutoff'
+            result = 'cutoff'
+        elif budget is not None and not budget.visit(node):
+            result = None
         else:
-            cutoff_occurred = False
-            for child in node.expand(problem):
-                result = recursive_dls(child, problem, limit - 1)
-                if result == 'cutoff':
-                    cutoff_occurred = True
-                elif result is not None:
-                    return result
-            return 'cutoff' if cutoff_occurred else None
-
-    # Body of depth_limited_search:
-    return recursive_dls(Node(problem.initial), problem, limit)
+            stack.append([iter(node.expand(problem)), limit - 1, False])
+            result = None
+        # pass the result up until a node has a child left to search
+        while stack:
+            frame = stack[-1]
+            if result == 'cutoff':
+                frame[2] = True
+            node = next(frame[0], None)
+            if node is not None:
+                limit = frame[1]
+                break
+            stack.pop()
+            result = 'cutoff' if frame[2] else None
+        else:
+            break
+    if result == 'cutoff' and budget is not None and budget.status is not None:
+        return None
+    return result
 
 
-def iterative_deepening_search(problem):
+def iterative_deepening_search(problem, budget=None):
     """[Figure 3.18]"""
     for depth in range(sys.maxsize):
-        result = depth_limited_search(problem, depth)
+        result = depth_limited_search(problem, depth, budget)
         if result != 'cutoff':
             return result
 
@@ -402,6 +622,256 @@ def bidirectional_search(problem):
     return np.inf
 
 
+# ______________________________________________________________________________
+# Exact Cover (Knuth's Algorithm X)
+
+
+class ExactCover:
+    """An exact cover matrix solved with Knuth's Algorithm X, generalized so
+    that an option may use an item several times. Each item has a demand:
+    primary items must be used exactly that many times, secondary items at
+    most that many times. Each option is a dict {item: weight}. Instead of
+    dancing links, the active options are the bits of an integer, and each
+    item keeps a bitset of the options that use it with each weight, so
+    unlinking options and linking them back are single bitwise operations."""
+
+    def __init__(self, demands, primary, options, budget=None):
+        self.budget = budget
+        self.remaining = dict(demands)
+        self.primary = list(primary)
+        self.options = options
+        self.masks = {item: {} for item in self.remaining}
+        self.active = 0
+        for index, option in enumerate(options):
+            if all(weight <= self.remaining[item] for item, weight in option.items()):
+                self.active |= 1 << index
+            for item, weight in option.items():
+                masks = self.masks[item]
+                masks[weight] = masks.get(weight, 0) | 1 << index
+        self.nodes = 0
+
+    def select(self, index):
+        """Use option 'index' and unlink the options that no longer fit."""
+        conflicts = 0
+        for item, weight in self.options[index].items():
+            self.remaining[item] -= weight
+            left = self.remaining[item]
+            for used, mask in self.masks[item].items():
+                if used > left:
+                    conflicts |= mask
+        self.active &= ~conflicts
+
+    def deselect(self, index):
+        for item, weight in self.options[index].items():
+            self.remaining[item] += weight
+
+    def choose(self):
+        """Return (feasible, item): the unsatisfied primary item with the
+        fewest active options (the column-count heuristic), or None if every
+        primary item is satisfied. The cover is not feasible if the active
+        options cannot use some item often enough."""
+        best, fewest = None, None
+        for item in self.primary:
+            needed = self.remaining[item]
+            if not needed:
+                continue
+            count = capacity = 0
+            for weight, mask in self.masks[item].items():
+                active = (mask & self.active).bit_count()
+                count += active
+                capacity += weight * active
+            if capacity < needed:
+                return False, item
+            if best is None or count < fewest:
+                best, fewest = item, count
+        return True, best
+
+    def search(self, solution):
+        if self.budget is not None and not self.budget.visit():
+            return False
+        self.nodes += 1
+        feasible, item = self.choose()
+        if not feasible:
+            return False
+        if item is None:
+            return True
+        saved = self.active
+        candidates = 0
+        for mask in self.masks[item].values():
+            candidates |= mask
+        candidates &= self.active
+        while candidates:
+            bit = candidates & -candidates
+            candidates ^= bit
+            index = bit.bit_length() - 1
+            active = self.active
+            self.select(index)
+            solution.append(index)
+            if self.search(solution):
+                return True
+            solution.pop()
+            self.deselect(index)
+            # no solution uses this option here, so the next ones are tried
+            # without it and the same cover is never found twice
+            self.active = active & ~bit
+        self.active = saved
+        return False
+
+    def solve(self):
+        """Return the indices of the options of a cover, or None."""
+        solution = []
+        return solution if self.search(solution) else None
+
+
+def exact_cover_search(problem, budget=None):
+    """Solve a problem that can be stated as an exact cover. The problem must
+    define exact_cover(), returning the item demands, the primary items and a
+    list of (action, {item: weight}) options. The actions of the cover are
+    applied, in the order given, from the initial state and the resulting
+    node is returned if it passes the goal test. With a budget, each
+    partial cover counts as a node."""
+    demands, primary, options = problem.exact_cover()
+    solution = ExactCover(demands, primary, [option for _, option in options],
+                          budget).solve()
+    if solution is None:
+        return None
+    node = Node(problem.initial)
+    for index in sorted(solution):
+        node = node.child_node(problem, options[index][0])
+    return node if problem.goal_test(node.state) else None
+
+
+def sat_search(problem, binary=None, budget=None):
+    """Solve a problem that can be encoded as a boolean formula. The problem
+    must define sat_encoding(), returning a sat.CNF and a dict {variable:
+    action}. The formula is solved by the embedded CDCL solver or, if given,
+    by a local solver binary. The actions whose variables are true in the
+    model are applied, by variable order, from the initial state and the
+    resulting node is returned if it passes the goal test. With a budget,
+    each decision of the embedded solver counts as a node; a binary is only
+    given the time left."""
+    cnf, actions = problem.sat_encoding()
+    model = solve_cnf(cnf, binary, budget)
+    if model is None:
+        return None
+    node = Node(problem.initial)
+    for var in sorted(actions):
+        if var in model:
+            node = node.child_node(problem, actions[var])
+    return node if problem.goal_test(node.state) else None
+
+
+# ______________________________________________________________________________
+# Parallel Depth-First Search
+
+
+_subtree_problem = None
+_subtree_stop = None
+_subtree_nodes = None
+
+
+def _init_subtree_worker(problem, stop, nodes):
+    global _subtree_problem, _subtree_stop, _subtree_nodes
+    _subtree_problem, _subtree_stop, _subtree_nodes = problem, stop, nodes
+
+
+def _count_subtree_nodes(count):
+    with _subtree_nodes.get_lock():
+        _subtree_nodes.value += count
+
+
+def _search_subtree(actions, check_every=256):
+    """Depth-first search, in a worker process, of the subtree reached by
+    applying the actions from the initial state. Return the actions from the
+    initial state to a goal, or None if there is none or the search is
+    stopped. The expanded nodes are added to a counter shared by the
+    workers every check_every nodes."""
+    problem = _subtree_problem
+    if _subtree_stop.is_set():
+        return None
+    node = Node(problem.initial)
+    for action in actions:
+        node = node.child_node(problem, action)
+    frontier = [node]  # Stack
+    count = 0
+    try:
+        while frontier:
+            count += 1
+            if count % check_every == 0:
+                _count_subtree_nodes(check_every)
+                if _subtree_stop.is_set():
+                    return None
+            node = frontier.pop()
+            if problem.goal_test(node.state):
+                return node.solution()
+            frontier.extend(node.expand(problem))
+        return None
+    finally:
+        _count_subtree_nodes(count % check_every)
+
+
+def parallel_depth_first_search(problem, workers=None, split=None, budget=None,
+                                poll=0.05):
+    """Depth-first tree search split across worker processes. The tree is
+    expanded breadth-first, keeping the order in which depth_first_tree_search
+    would visit the nodes, until there are at least 'split' subtrees (by
+    default four per worker). The subtrees are queued in that order; an idle
+    worker takes the next one, so the load balances itself, and as soon as a
+    worker finds a goal the others are stopped. The problem must be picklable
+    and its actions deterministic: the goal found by a worker is rebuilt here
+    from its actions. With a budget, the nodes expanded by the workers are
+    counted every 'poll' seconds and the workers are stopped once the
+    budget runs out."""
+    workers = workers or os.cpu_count()
+    split = split or 4 * workers
+    frontier = [Node(problem.initial)]
+    while frontier and len(frontier) < split:
+        nodes = []
+        for node in frontier:
+            if problem.goal_test(node.state):
+                return node
+            if budget is not None and not budget.visit(node):
+                return None
+            # the last child is the first one popped from the stack
+            nodes.extend(reversed(node.expand(problem)))
+        frontier = nodes
+    if not frontier:
+        return None
+
+    solution = None
+    stop = multiprocessing.Event()
+    nodes = multiprocessing.Value('q', 0)
+    with ProcessPoolExecutor(workers, initializer=_init_subtree_worker,
+                             initargs=(problem, stop, nodes)) as executor:
+        futures = [executor.submit(_search_subtree, node.solution())
+                   for node in frontier]
+        counted = 0
+        try:
+            pending = set(futures)
+            while pending and solution is None:
+                done, pending = wait(pending, None if budget is None else poll,
+                                     FIRST_COMPLETED)
+                for future in done:
+                    solution = future.result()
+                    if solution is not None:
+                        break
+                if budget is not None:
+                    total = nodes.value
+                    if not budget.charge(total - counted):
+                        break
+                    counted = total
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+    if solution is None:
+        return None
+    node = Node(problem.initial)
+    for action in solution:
+        node = node.child_node(problem, action)
+    return node if problem.goal_test(node.state) else None
+
+
 # ______________________________________________________________________________
 # Informed (Heuristic) Search
 
@@ -410,17 +880,57 @@ greedy_best_first_graph_search = best_first_graph_search
 
 
 # Greedy best-first search is accomplished by specifying f(n) = h(n).
-def greedy_search(problem, h=None):
+def greedy_search(problem, h=None, budget=None, compact=False):
     """f(n) = h(n)"""
     h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, h)
+    return best_first_graph_search(problem, h, budget=budget, compact=compact)
 
-def astar_search(problem, h=None, display=False):
+def astar_search(problem, h=None, display=False, budget=None, compact=False):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
     else in your Problem subclass."""
     h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, lambda n: n.path_cost + h(n), display)
+    return best_first_graph_search(problem, lambda n: n.path_cost + h(n), display, budget,
+                                   compact)
+
+
+def ida_star_search(problem, h=None, transpositions=0, budget=None):
+    """Iterative deepening A* search: a series of depth-first searches that
+    prune the nodes with f(n) = g(n) + h(n) above a bound, starting from f of
+    the initial node and raised each time to the lowest f that was pruned.
+    Memory grows only with the depth of the search. If 'transpositions' is
+    positive, a TranspositionTable of that size keeps the lowest path cost
+    at which each state was expanded in the current iteration, and a state
+    is not expanded again at a cost that is not lower."""
+    h = memoize(h or problem.h, 'h')
+    root = Node(problem.initial)
+    bound = root.path_cost + h(root)
+    table = TranspositionTable(transpositions) if transpositions else None
+    iteration = 0
+    while True:
+        iteration += 1
+        next_bound = np.inf
+        frontier = [root]  # Stack
+        while frontier:
+            node = frontier.pop()
+            f = node.path_cost + h(node)
+            if f > bound:
+                next_bound = min(next_bound, f)
+                continue
+            if problem.goal_test(node.state):
+                return node
+            if table is not None:
+                seen = table.get(node.state)
+                if seen is not None and seen[0] == iteration and seen[1] <= node.path_cost:
+                    continue
+                table.add(node.state, (iteration, node.path_cost))
+            if budget is not None and not budget.visit(node, h(node)):
+                return None
+            # the first child is searched first
+            frontier.extend(reversed(node.expand(problem)))
+        if next_bound == np.inf:
+            return None
+        bound = next_bound
 
 
 # ______________________________________________________________________________
@@ -603,36 +1113,58 @@ class PlanRoute(Problem):
 # Other search algorithms
 
 
-def recursive_best_first_search(problem, h=None):
-    """[Figure 3.26]"""
+def recursive_best_first_search(problem, h=None, budget=None):
+    """[Figure 3.26]
+    The recursive calls of RBFS are kept on an explicit stack, and the
+    successors of each call in a heap ordered by f instead of a list sorted
+    again on every iteration. Ties are broken as the stable sort would: a
+    successor whose f was just backed up goes before the others with the
+    same f, and the rest keep the order in which they were generated."""
     h = memoize(h or problem.h, 'h')
 
-    def RBFS(problem, node, flimit):
-        if problem.goal_test(node.state):
-            return node, 0  # (The second value is immaterial)
-        successors = node.expand(problem)
-        if len(successors) == 0:
-            return None, np.inf
-        for s in successors:
-            s.f = max(s.path_cost + h(s), node.f)
-        while True:
-            # Order by lowest f value
-            successors.sort(key=lambda x: x.f)
-            best = successors[0]
-            if best.f > flimit:
-                return None, best.f
-            if len(successors) > 1:
-                alternative = successors[1].f
-            else:
-                alternative = np.inf
-            result, best.f = RBFS(problem, best, min(flimit, alternative))
-            if result is not None:
-                return result, best.f
-
+    # The calls of RBFS in progress, innermost last, as [flimit, heap of the
+    # successors as (f, order, node), order for the next backed-up successor,
+    # the successor being searched]
+    stack = []
     node = Node(problem.initial)
     node.f = h(node)
-    result, bestf = RBFS(problem, node, np.inf)
-    return result
+    flimit = np.inf
+    while True:
+        # RBFS(problem, node, flimit)
+        if problem.goal_test(node.state):
+            return node
+        f = np.inf
+        if budget is None or budget.visit(node, node.f):
+            successors = node.expand(problem)
+            if successors:
+                for s in successors:
+                    s.f = max(s.path_cost + h(s), node.f)
+                heap = [(s.f, order, s) for order, s in enumerate(successors)]
+                heapq.heapify(heap)
+                stack.append([flimit, heap, -1, None])
+                f = None
+        # return f to the calling RBFS until one searches another successor
+        while stack:
+            frame = stack[-1]
+            flimit, heap, order, best = frame
+            if best is not None:
+                best.f = f
+                if budget is not None and budget.status is not None:
+                    stack.pop()
+                    f = np.inf
+                    continue
+                heapq.heappush(heap, (f, order, best))
+                frame[2] -= 1
+            f, _, best = heapq.heappop(heap)
+            if f > flimit:
+                stack.pop()
+                continue
+            frame[3] = node = best
+            alternative = heap[0][0] if heap else np.inf
+            flimit = min(flimit, alternative)
+            break
+        else:
+            return None
 
 
 def hill_climbing(problem):
@@ -724,10 +724,20 @@ class PriorityQueue:
     order) is returned first.
     If order is 'min', the item with minimum f(x) is
     returned first; if order is 'max', then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
+    Also supports dict-like lookup.
+    An index from each item to its entries in the heap makes membership and
+    lookup O(1) and deletion O(1) amortized: deleted entries are only marked,
+    and are dropped when they reach the top of the heap (or when they are
+    more than half of it, by rebuilding the heap)."""
 
     def __init__(self, order='min', f=lambda x: x):
         self.heap = []
+        # item -> (value, serial) of its entry still in the queue, or a list
+        # of them if the item was appended more than once
+        self.index = {}
+        self.deleted = set()
+        self.serial = 0
+        self.size = 0
         if order == 'min':
             self.f = f
         elif order == 'max':  # now item with max f(x)
@@ -737,7 +747,18 @@ class PriorityQueue:
 
     def append(self, item):
         """Insert item at its correct position."""
-        heapq.heappush(self.heap, (self.f(item), item))
+        value = self.f(item)
+        self.serial += 1
+        heapq.heappush(self.heap, (value, item, self.serial))
+        entry = (value, self.serial)
+        entries = self.index.get(item)
+        if entries is None:
+            self.index[item] = entry
+        elif isinstance(entries, list):
+            entries.append(entry)
+        else:
+            self.index[item] = [entries, entry]
+        self.size += 1
 
     def extend(self, items):
         """Insert each item in items at its correct position."""
@@ -747,34 +768,85 @@ class PriorityQueue:
     def pop(self):
         """Pop and return the item (with min or max f(x) value)
         depending on the order."""
-        if self.heap:
-            return heapq.heappop(self.heap)[1]
+        while self.heap:
+            _, item, serial = heapq.heappop(self.heap)
+            if serial in self.deleted:
+                self.deleted.remove(serial)
+                continue
+            self.forget(item, serial)
+            return item
+        raise Exception('Trying to pop from empty PriorityQueue.')
+
+    def forget(self, item, serial):
+        entries = self.index[item]
+        if isinstance(entries, list):
+            entries[:] = [entry for entry in entries if entry[1] != serial]
+            if len(entries) == 1:
+                self.index[item] = entries[0]
         else:
-            raise Exception('Trying to pop from empty PriorityQueue.')
+            del self.index[item]
+        self.size -= 1
+
+    def first(self, key):
+        """The (value, serial) entry of key with the lowest value."""
+        entries = self.index[key]
+        return min(entries) if isinstance(entries, list) else entries
 
     def __len__(self):
         """Return current capacity of PriorityQueue."""
-        return len(self.heap)
+        return self.size
 
     def __contains__(self, key):
         """Return True if the key is in PriorityQueue."""
-        return any([item == key for _, item in self.heap])
+        return key in self.index
 
     def __getitem__(self, key):
         """Returns the first value associated with key in PriorityQueue.
         Raises KeyError if key is not present."""
-        for value, item in self.heap:
-            if item == key:
-                return value
-        raise KeyError(str(key) + " is not in the priority queue")
+        try:
+            return self.first(key)[0]
+        except KeyError:
+            raise KeyError(str(key) + " is not in the priority queue")
 
     def __delitem__(self, key):
         """Delete the first occurrence of key."""
         try:
-            del self.heap[[item == key for _, item in self.heap].index(True)]
-        except ValueError:
+            _, serial = self.first(key)
+        except KeyError:
             raise KeyError(str(key) + " is not in the priority queue")
-        heapq.heapify(self.heap)
+        self.forget(key, serial)
+        self.deleted.add(serial)
+        if len(self.deleted) > len(self.heap) // 2:
+            self.heap = [entry for entry in self.heap if entry[2] not in self.deleted]
+            heapq.heapify(self.heap)
+            self.deleted.clear()
+
+
+class TranspositionTable:
+    """A bounded table of already-seen states (or their keys), optionally
+    mapping each one to a value. When the table is full the least recently
+    stored entry is evicted, so memory stays flat on long searches."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.table = collections.OrderedDict()
+
+    def add(self, key, value=True):
+        """Store key (with value), evicting the oldest entry if full."""
+        self.table[key] = value
+        self.table.move_to_end(key)
+        if len(self.table) > self.maxsize:
+            self.table.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Return the value stored for key, or default."""
+        return self.table.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.table
+
+    def __len__(self):
+        return len(self.table)
 
 
 # ______________________________________________________________________________